@@ -0,0 +1,169 @@
+# admission.py  (rate limits and load shedding for the AI endpoints)
+#
+# Every request to an AI route passes, in order:
+#   1. a priority gate: at most `limit` requests of this worker in flight,
+#      waiters served best priority first (evaluations before lessons),
+#   2. the caller's token bucket (per user, refilled at user_rate/s),
+#   3. the global token bucket (all users, all workers).
+# Buckets live in the shared state (see sharedstate.py), so every worker
+# spends from the same tokens. Whatever doesn't get through is answered at
+# once with 429 and a Retry-After, and counted per reason.
+import math
+import time
+import heapq
+import asyncio
+import itertools
+
+from starlette.requests import HTTPConnection
+from starlette.responses import JSONResponse
+
+COOKIE = "thetamind_user"
+REASONS = ("user_rate", "global_rate", "queue_full", "displaced", "timeout")
+
+
+class Overloaded(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class PriorityGate:
+    """Concurrency limit with a bounded wait queue ordered by priority (lower
+    is served first). A full queue makes room for a better-priority arrival
+    by turning away its worst waiter."""
+
+    def __init__(self, limit=32, max_queue=64, max_wait=5.0):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self._waiters = []   # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._hold = 1.0     # moving average of seconds a slot is held, for Retry-After
+
+    def retry_after(self):
+        return self._hold * (len(self._waiters) // self.limit + 1)
+
+    def try_acquire(self):
+        """Take a slot only if one is free now and nobody is queued for it."""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        return False
+
+    async def acquire(self, priority):
+        if self.try_acquire():
+            return
+        if len(self._waiters) >= self.max_queue:
+            worst = max(self._waiters)
+            if worst[0] <= priority:
+                raise Overloaded("queue_full", self.retry_after())
+            self._waiters.remove(worst)
+            heapq.heapify(self._waiters)
+            worst[2].set_exception(Overloaded("displaced", self.retry_after()))
+        entry = (priority, next(self._seq), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, entry)
+        try:
+            await asyncio.wait_for(entry[2], self.max_wait)
+        except asyncio.TimeoutError:
+            self._discard(entry)
+            raise Overloaded("timeout", self.retry_after())
+        except asyncio.CancelledError:
+            self._discard(entry)
+            raise
+
+    def _discard(self, entry):
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+        elif entry[2].done() and not entry[2].cancelled() and entry[2].exception() is None:
+            self.release()  # the slot was handed over just as we gave up; pass it on
+
+    def release(self, held=None):
+        if held is not None:
+            self._hold = 0.9 * self._hold + 0.1 * held
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)  # the slot moves to the waiter; active is unchanged
+                return
+        self.active -= 1
+
+    @property
+    def depth(self):
+        return len(self._waiters)
+
+
+class Admission:
+    def __init__(self, state, gate, routes, user_rate=0.5, user_burst=10, global_rate=20.0, global_burst=60,
+                 resolve=None):
+        self.state = state
+        self.gate = gate
+        self.routes = routes            # path -> (name, priority)
+        self.user_rate = user_rate      # tokens per second; 0 turns the bucket off
+        self.user_burst = user_burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.resolve = resolve          # async (cookie username) -> users row or None
+        self.admitted = {}
+        self.rejected = {reason: 0 for reason in REASONS}
+
+    async def charge(self, user_id, cost=1):
+        """Spend tokens from the caller's and the global bucket, or raise Overloaded.
+        A batch costs one token per AI call, capped at the bucket size so it can
+        always go through once the bucket is full."""
+        if self.user_rate:
+            ok, retry = await self.state.throttle(f"rate:user:{user_id}", self.user_rate, self.user_burst,
+                                                  min(cost, self.user_burst))
+            if not ok:
+                raise Overloaded("user_rate", retry)
+        if self.global_rate:
+            ok, retry = await self.state.throttle("rate:global", self.global_rate, self.global_burst,
+                                                  min(cost, self.global_burst))
+            if not ok:
+                raise Overloaded("global_rate", retry)
+
+    def reject(self, e):
+        self.rejected[e.reason] += 1
+        return JSONResponse({"error": "Too many requests, please try again in a moment.", "reason": e.reason},
+                            status_code=429, headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+
+    def stats(self):
+        return {"in_flight": self.gate.active, "queued": self.gate.depth, "limit": self.gate.limit,
+                "admitted": dict(self.admitted), "rejected": dict(self.rejected)}
+
+
+class AdmissionMiddleware:
+    """Plain ASGI, so the slot is held until a streamed response has finished."""
+
+    def __init__(self, app, admission):
+        self.app = app
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        route = self.admission.routes.get(scope["path"]) if scope["type"] == "http" else None
+        if route is None or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        name, priority = route
+        try:
+            # only known users spend tokens; anyone else gets their 401 from the route
+            resolve = self.admission.resolve
+            user = await resolve(HTTPConnection(scope).cookies.get(COOKIE)) if resolve else None
+            # the gate first, so a request it turns away hasn't spent anyone's tokens
+            await self.admission.gate.acquire(priority)
+            if user:
+                try:
+                    await self.admission.charge(user["id"])
+                except Overloaded:
+                    self.admission.gate.release()
+                    raise
+        except Overloaded as e:
+            scope["route_label"] = scope["path"]
+            return await self.admission.reject(e)(scope, receive, send)
+        self.admission.admitted[name] = self.admission.admitted.get(name, 0) + 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.gate.release(time.perf_counter() - start)
@@ -0,0 +1,189 @@
+# aicache.py  (content-addressed response cache in front of ai_q)
+#
+# Responses are keyed by sha256(model + whitespace-normalized prompt), so the
+# same lesson/quiz prompt from different students maps to one entry. Lookups
+# go memory tier first (LRU + TTL), then the optional SQLite tier. Whether and
+# how long an endpoint's responses are kept is decided by its Policy, which
+# also says whether concurrent identical prompts share one upstream call.
+import re
+import json
+import time
+import hashlib
+from dataclasses import dataclass
+
+import db
+from cache import TTLCache, MISSING
+from singleflight import SingleFlight
+
+
+@dataclass(frozen=True)
+class Policy:
+    ttl: float              # seconds; 0 means never cache
+    persist: bool = False   # also keep in the SQLite tier
+    coalesce: bool = True   # identical in-flight prompts share one upstream call
+
+
+POLICIES = {
+    "lesson": Policy(ttl=7 * 24 * 3600, persist=True),
+    "solve": Policy(ttl=24 * 3600, persist=True),
+    # a cached question would come back on every click, even to whoever just answered it
+    "quiz": Policy(ttl=0, coalesce=True),
+    "evaluate": Policy(ttl=0, coalesce=False),
+}
+NO_CACHE = Policy(ttl=0, coalesce=False)
+
+_WS = re.compile(r"\s+")
+
+
+def prompt_key(prompt: str, model: str) -> str:
+    normalized = _WS.sub(" ", prompt).strip()
+    return hashlib.sha256(f"{model}\n{normalized}".encode("utf-8")).hexdigest()
+
+
+def cacheable(response: str) -> bool:
+    """Only well-formed JSON objects without an "error" key are worth keeping."""
+    try:
+        data = json.loads(response)
+    except (json.JSONDecodeError, TypeError):
+        return False
+    return isinstance(data, dict) and "error" not in data
+
+
+class SQLiteTier:
+    """Persistent tier: one row per key in the ai_cache table, expired by TTL."""
+
+    def __init__(self, pool=db.pool, max_rows=20000, prune_every=200):
+        self.pool = pool
+        self.max_rows = max_rows
+        self.prune_every = prune_every
+        self._writes = 0
+
+    def init(self, conn):
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS ai_cache (
+            key TEXT PRIMARY KEY,
+            endpoint TEXT NOT NULL,
+            response TEXT NOT NULL,
+            cost REAL NOT NULL,
+            created REAL NOT NULL,
+            expires REAL NOT NULL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_ai_cache_expires ON ai_cache (expires)")
+
+    async def get(self, key):
+        """Returns (response, cost, expires) or None."""
+        row = await self.pool.fetchone("SELECT response, cost, expires FROM ai_cache WHERE key = ? AND expires > ?",
+                                       (key, time.time()))
+        return (row["response"], row["cost"], row["expires"]) if row else None
+
+    async def set(self, key, endpoint, response, cost, ttl):
+        now = time.time()
+        await self.pool.execute("INSERT OR REPLACE INTO ai_cache (key, endpoint, response, cost, created, expires) VALUES (?, ?, ?, ?, ?, ?)",
+                                (key, endpoint, response, cost, now, now + ttl))
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            await self.prune()
+
+    async def prune(self):
+        def job(conn):
+            conn.execute("DELETE FROM ai_cache WHERE expires <= ?", (time.time(),))
+            conn.execute("DELETE FROM ai_cache WHERE key NOT IN (SELECT key FROM ai_cache ORDER BY created DESC LIMIT ?)",
+                         (self.max_rows,))
+        await self.pool.run(job)
+
+
+class AIResponseCache:
+    """Two-tier cache used by ai_q. `memory` can be any object with TTLCache's
+    get/set/stats interface, which is how the eviction policy is swapped."""
+
+    def __init__(self, memory=None, persistent=None, policies=POLICIES):
+        self.memory = memory if memory is not None else TTLCache(maxsize=2048)
+        self.persistent = persistent
+        self.policies = policies
+        self.flights = SingleFlight()
+        self.counters = {}
+
+    def _count(self, endpoint, field, amount=1):
+        c = self.counters.setdefault(endpoint or "default", {
+            "memory_hits": 0, "persistent_hits": 0, "misses": 0, "bypassed": 0, "coalesced": 0, "saved_seconds": 0.0})
+        c[field] += amount
+
+    def policy(self, endpoint):
+        return self.policies.get(endpoint, NO_CACHE)
+
+    async def lookup(self, endpoint, key):
+        """Returns the cached response or None, updating the hit counters."""
+        policy = self.policy(endpoint)
+        hit = self.memory.get(key, MISSING)
+        if hit is not MISSING:
+            response, cost = hit
+            self._count(endpoint, "memory_hits")
+            self._count(endpoint, "saved_seconds", cost)
+            return response
+        if policy.persist and self.persistent is not None:
+            hit = await self.persistent.get(key)
+            if hit:
+                response, cost, expires = hit
+                self.memory.set(key, (response, cost), ttl=min(policy.ttl, expires - time.time()))
+                self._count(endpoint, "persistent_hits")
+                self._count(endpoint, "saved_seconds", cost)
+                return response
+        return None
+
+    async def store(self, endpoint, key, response, cost):
+        policy = self.policy(endpoint)
+        if not cacheable(response):
+            return
+        self.memory.set(key, (response, cost), ttl=policy.ttl)
+        if policy.persist and self.persistent is not None:
+            await self.persistent.set(key, endpoint, response, cost, policy.ttl)
+
+    async def get_or_call(self, endpoint, prompt, model, call):
+        """Serve `prompt` from cache per the endpoint's policy, else await call()."""
+        policy = self.policy(endpoint)
+        key = prompt_key(prompt, model)
+        if policy.ttl:
+            response = await self.lookup(endpoint, key)
+            if response is not None:
+                return response
+            self._count(endpoint, "misses")
+        else:
+            self._count(endpoint, "bypassed")
+        if not policy.coalesce:
+            return await self._fetch(endpoint, key, call)
+        if key in self.flights:
+            self._count(endpoint, "coalesced")
+        return await self.flights.do(key, lambda: self._fetch(endpoint, key, call))
+
+    async def _fetch(self, endpoint, key, call):
+        start = time.perf_counter()
+        response = await call()
+        if self.policy(endpoint).ttl:
+            await self.store(endpoint, key, response, time.perf_counter() - start)
+        return response
+
+    async def stream_or_call(self, endpoint, prompt, model, stream):
+        """Like get_or_call, but yields chunks from stream() as they arrive and
+        caches the joined text once the stream ends. A hit is yielded whole."""
+        policy = self.policy(endpoint)
+        key = prompt_key(prompt, model)
+        if policy.ttl:
+            response = await self.lookup(endpoint, key)
+            if response is not None:
+                yield response
+                return
+            self._count(endpoint, "misses")
+        else:
+            self._count(endpoint, "bypassed")
+        start = time.perf_counter()
+        parts = []
+        async for chunk in stream():
+            parts.append(chunk)
+            yield chunk
+        if policy.ttl:
+            await self.store(endpoint, key, "".join(parts), time.perf_counter() - start)
+
+    def stats(self):
+        endpoints = {name: dict(c, saved_seconds=round(c["saved_seconds"], 3)) for name, c in self.counters.items()}
+        return {"memory": self.memory.stats(), "single_flight": self.flights.stats(), "endpoints": endpoints}
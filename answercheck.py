@@ -0,0 +1,325 @@
+# answercheck.py  (local answer checking before the LLM evaluation)
+#
+# Pulls the final expression out of the student's and the reference solution
+# ("... Combine like terms: 2x² - 5x - 3." -> 2x^2 - 5x - 3), parses both with
+# a small arithmetic grammar (+ - * / ^, implicit multiplication, sqrt, pi)
+# and compares them by evaluating at fixed sample points, which decides
+# polynomial/rational identities without a CAS. check() answers True/False
+# only when that is clear-cut and None otherwise, in which case the caller
+# asks the model as before. Inequalities, and tasks whose point is the form
+# of the answer (expand, simplify, factor) or that end in a check step, are
+# always left to the model: equal values say nothing about them.
+import re
+import math
+import time
+
+SAMPLES = (0.5772156649, 1.4142135624, -2.7182818285, 3.1415926536, -0.3183098862)
+EXACT = 1e-9        # relative difference still counted as equal
+NEAR = 1e-2         # closer than this but not equal: probably rounding, let the model judge
+MAX_LEN = 200
+MAX_EXPONENT = 50
+
+_NORMALIZE = [("²", "^2"), ("³", "^3"), ("−", "-"), ("–", "-"), ("×", "*"), ("·", "*"), ("÷", "/"),
+              ("**", "^"), ("π", "pi"), ("√", "sqrt"), ("$", "")]
+_SPLIT = re.compile(r"=|:|\n|\.\s+(?=[A-Za-z])|\b(?:is|equals|gives)\b")
+_TRAILING_MATH = re.compile(r"(?<![A-Za-z])((?:\d+\.?\d*|\.\d+|(?<![A-Za-z])[A-Za-z](?![A-Za-z])|sqrt|pi|[\s+\-*/^()])+)$")
+_BARE = re.compile(r"\s*(?:[A-Za-z]\s*=\s*)?(.+?)[\s.]*$", re.S)
+_SENTENCE = re.compile(r"\n|\.\s+(?=[A-Za-z])")
+_SEVERAL = re.compile(r",|;|±|\+/-|\b(?:or|and)\b")   # "x = 2 or x = 3": more than one answer
+_RELATIONAL = re.compile(r"[<>≤≥≠]|!=")
+_FORM_CUES = re.compile(r"\b(?:expand|simplif|factor|check|verif)|lowest terms", re.I)
+_TOKEN = re.compile(r"\s*(?:(\d+\.?\d*|\.\d+)|([A-Za-z]+)|(.))")
+FUNCS = {"sqrt": math.sqrt}
+
+
+class ParseError(ValueError):
+    pass
+
+
+# --- Parsing ---
+def normalize(text):
+    for a, b in _NORMALIZE:
+        text = text.replace(a, b)
+    return text.strip()
+
+
+def _tokens(expr):
+    out = []
+    for number, word, op in _TOKEN.findall(expr):
+        if number:
+            out.append(("num", float(number)))
+        elif word:
+            if word in FUNCS or word == "pi":
+                out.append(("name", word))
+            elif len(word) == 1:
+                out.append(("var", word))
+            else:
+                raise ParseError(f"unexpected word {word!r}")
+        elif op in "+-*/^()":
+            out.append(("op", op))
+        elif not op.isspace():
+            raise ParseError(f"unexpected {op!r}")
+    return out
+
+
+class _Parser:
+    """expr := term (+|- term)*   term := unary ((*|/)? unary)*   unary := -unary | power
+    power := atom (^ unary)?      atom := number | var | pi | sqrt(expr) | (expr)"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.i = 0
+
+    def peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else (None, None)
+
+    def take(self):
+        tok = self.peek()
+        self.i += 1
+        return tok
+
+    def expect(self, op):
+        if self.take() != ("op", op):
+            raise ParseError(f"expected {op!r}")
+
+    def parse(self):
+        node = self.expr()
+        if self.i != len(self.tokens):
+            raise ParseError("trailing input")
+        return node
+
+    def expr(self):
+        node = self.term()
+        while self.peek() in (("op", "+"), ("op", "-")):
+            node = (self.take()[1], node, self.term())
+        return node
+
+    def term(self):
+        node = self.unary()
+        while True:
+            kind, value = self.peek()
+            if kind == "op" and value in "*/":
+                self.take()
+                node = (value, node, self.unary())
+            elif kind in ("num", "var", "name") or (kind, value) == ("op", "("):
+                node = ("*", node, self.unary())   # implicit: 2x, 3(x + 1), (x + 1)(x - 2)
+            else:
+                return node
+
+    def unary(self):
+        if self.peek() == ("op", "-"):
+            self.take()
+            return ("neg", self.unary())
+        if self.peek() == ("op", "+"):
+            self.take()
+            return self.unary()
+        return self.power()
+
+    def power(self):
+        node = self.atom()
+        if self.peek() == ("op", "^"):
+            self.take()
+            node = ("^", node, self.unary())
+        return node
+
+    def atom(self):
+        kind, value = self.take()
+        if kind == "num":
+            return ("num", value)
+        if kind == "var":
+            return ("var", value)
+        if kind == "name":
+            if value == "pi":
+                return ("num", math.pi)
+            self.expect("(")
+            node = self.expr()
+            self.expect(")")
+            return ("call", value, node)
+        if (kind, value) == ("op", "("):
+            node = self.expr()
+            self.expect(")")
+            return node
+        raise ParseError("expected a number, variable or '('")
+
+
+def parse(expr):
+    if not expr or len(expr) > MAX_LEN:
+        raise ParseError("empty or too long")
+    return _Parser(_tokens(expr)).parse()
+
+
+def variables(node):
+    if node[0] == "var":
+        return {node[1]}
+    if node[0] == "num":
+        return set()
+    return set().union(*(variables(child) for child in node[1:] if isinstance(child, tuple)))
+
+
+def evaluate(node, env):
+    op = node[0]
+    if op == "num":
+        return node[1]
+    if op == "var":
+        return env[node[1]]
+    if op == "neg":
+        return -evaluate(node[1], env)
+    if op == "call":
+        return FUNCS[node[1]](evaluate(node[2], env))
+    a, b = evaluate(node[1], env), evaluate(node[2], env)
+    if op == "+":
+        return a + b
+    if op == "-":
+        return a - b
+    if op == "*":
+        return a * b
+    if op == "/":
+        return a / b
+    if abs(b) > MAX_EXPONENT:
+        raise OverflowError("exponent too large")
+    result = a ** b
+    if isinstance(result, complex):
+        raise ValueError("complex result")
+    return result
+
+
+# --- Extraction and comparison ---
+def _try_parse(fragment):
+    fragment = fragment.strip().rstrip(".;,!").strip()
+    try:
+        return parse(fragment)
+    except ParseError:
+        match = _TRAILING_MATH.search(fragment)
+        if match and re.search(r"[\dA-Za-z]", match.group(1)):
+            try:
+                return parse(match.group(1).strip())
+            except ParseError:
+                return None
+    return None
+
+
+def final_answer(text):
+    """Parsed final expression of a worked solution, or None if there isn't an unambiguous one."""
+    text = normalize(text or "")[-2000:].rstrip(" .!")
+    if _SEVERAL.search(_SENTENCE.split(text)[-1]):
+        return None
+    fragments = [f for f in _SPLIT.split(text) if f and f.strip(" .;,!")]
+    return _try_parse(fragments[-1]) if fragments else None
+
+
+def is_bare(text):
+    """True when the student wrote only an answer ("2x^2-5x-3", "x = 4"), no working."""
+    match = _BARE.fullmatch(normalize(text or ""))
+    if not match:
+        return False
+    try:
+        parse(match.group(1))
+        return True
+    except ParseError:
+        return False
+
+
+def equivalent(a, b):
+    """True/False when the two parsed expressions clearly agree/differ, None when unsure."""
+    names = sorted(variables(a) | variables(b))
+    compared = 0
+    for k in range(len(SAMPLES)):
+        env = {name: SAMPLES[(k + j) % len(SAMPLES)] + j for j, name in enumerate(names)}
+        try:
+            x, y = evaluate(a, env), evaluate(b, env)
+        except (ZeroDivisionError, OverflowError, ValueError):
+            continue
+        diff = abs(x - y) / max(1.0, abs(x), abs(y))
+        if diff > NEAR:
+            return False
+        if diff > EXACT:
+            return None
+        compared += 1
+    return True if compared >= 3 else None
+
+
+def check(student_solution, correct_solution):
+    """True (right), False (clearly wrong) or None (leave it to the model).
+    False needs both the answer and the reference to be bare answers.
+
+    >>> check("(2x + 1)(x - 3)", "Combine like terms to get the final area: 2x² - 5x - 3.")
+    True
+    >>> check("x = 4", "x = 3")
+    False
+    >>> check("x = 4", "The solution is x = 3.") is None  # reference is worked: the model explains
+    True
+    >>> check("Expanding gives 2x^2 - 6x - 3", "2x² - 5x - 3") is None  # shows working: model explains
+    True
+    >>> check("x = 2 or x = 3", "x = 2, x = 3") is None
+    True
+    """
+    if _RELATIONAL.search(correct_solution or "") or _RELATIONAL.search(student_solution or ""):
+        return None  # inequality: the bounding number alone isn't the answer
+    if _FORM_CUES.search(correct_solution or ""):
+        return None  # expand/simplify/factor asks for a form; a trailing check step isn't the answer
+    expected = final_answer(correct_solution)
+    given = final_answer(student_solution)
+    if expected is None or given is None:
+        return None
+    if not variables(given) <= variables(expected):
+        return None  # different variable names; not something to judge mechanically
+    verdict = equivalent(given, expected)
+    if verdict is False and not (is_bare(student_solution) and is_bare(correct_solution)):
+        return None  # working on either side: the model can say where it went wrong
+    return verdict
+
+
+def feedback(is_correct, student_solution, correct_solution):
+    """Evaluation in the same shape the model returns."""
+    if is_correct:
+        return {
+            "is_correct": True,
+            "feedback": "Correct! Your final answer matches the expected result.",
+            "smarter_way": "Quick self-check: substitute a simple value such as x = 1 into your answer and the original expression; both should give the same number.",
+            "checked_locally": True,
+        }
+    return {
+        "is_correct": False,
+        "feedback": "Not quite. Your final answer does not match the expected result. Go back over each step, watching signs and how like terms combine.",
+        "smarter_way": f"Worked solution: {correct_solution}",
+        "checked_locally": True,
+    }
+
+
+class CheckerStats:
+    """Fraction of evaluations settled locally, and model time that saved (at the
+    running average latency of the evaluations that did go to the model)."""
+
+    def __init__(self):
+        self.local = 0
+        self.escalated = 0
+        self.local_seconds = 0.0
+        self.model_seconds = 0.0
+
+    def record_local(self, seconds):
+        self.local += 1
+        self.local_seconds += seconds
+
+    def record_model(self, seconds):
+        self.escalated += 1
+        self.model_seconds += seconds
+
+    def stats(self):
+        total = self.local + self.escalated
+        avg_model = self.model_seconds / self.escalated if self.escalated else None
+        return {
+            "evaluations": total,
+            "resolved_locally": self.local,
+            "escalated": self.escalated,
+            "local_fraction": round(self.local / total, 4) if total else 0.0,
+            "avg_local_ms": round(self.local_seconds / self.local * 1000, 3) if self.local else None,
+            "avg_model_ms": round(avg_model * 1000, 1) if avg_model is not None else None,
+            "saved_seconds": round(self.local * avg_model - self.local_seconds, 3) if avg_model is not None else None,
+        }
+
+
+def timed_check(student_solution, correct_solution):
+    """check() plus how long it took, for CheckerStats."""
+    start = time.perf_counter()
+    verdict = check(student_solution, correct_solution)
+    return verdict, time.perf_counter() - start
@@ -0,0 +1,124 @@
+# assets.py  (fingerprinted, precompressed static assets)
+#
+#   python assets.py build     copy static/ to dist/ under content-hashed names,
+#                              write .gz (and .br if `brotli` is installed) next
+#                              to each text asset, and a manifest.json
+#
+# Templates link assets through the asset_url() Jinja global: with a build it
+# returns /assets/<hashed name>, served by AssetFiles as immutable for a year
+# (a new build means new URLs); without one it falls back to /static/<path>,
+# so development needs no build step.
+import os
+import sys
+import gzip
+import json
+import shutil
+import hashlib
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import StaticFiles
+
+SOURCE = "static"
+DIST = os.getenv("ASSET_DIR", "dist")
+PREFIX = "/assets"
+COMPRESS = (".css", ".js", ".svg", ".json", ".txt", ".html")
+MIN_SIZE = 512
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# --- Build ---
+def fingerprint(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def build(source=SOURCE, dist=DIST):
+    """Rebuild dist/ from source/ and return the manifest {logical path: hashed path}."""
+    if os.path.isdir(dist):
+        shutil.rmtree(dist)
+    manifest = {}
+    for root, _, files in os.walk(source):
+        for name in sorted(files):
+            src = os.path.join(root, name)
+            logical = os.path.relpath(src, source).replace(os.sep, "/")
+            stem, ext = os.path.splitext(logical)
+            hashed = f"{stem}.{fingerprint(src)}{ext}"
+            dest = os.path.join(dist, hashed)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(src, dest)
+            if ext in COMPRESS and os.path.getsize(src) >= MIN_SIZE:
+                with open(src, "rb") as f:
+                    data = f.read()
+                with open(dest + ".gz", "wb") as f:
+                    f.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(dest + ".br", "wb") as f:
+                        f.write(brotli.compress(data, quality=11))
+            manifest[logical] = hashed
+    with open(os.path.join(dist, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+# --- Serving ---
+class Manifest:
+    def __init__(self, dist=DIST):
+        self.dist = dist
+        self.entries = {}
+
+    def load(self):
+        try:
+            with open(os.path.join(self.dist, "manifest.json")) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        return self
+
+    def url(self, path):
+        hashed = self.entries.get(path)
+        return f"{PREFIX}/{hashed}" if hashed else f"/static/{path}"
+
+
+def _accepts(header, coding):
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip() == coding:
+            return params.replace(" ", "") not in ("q=0", "q=0.0")
+    return False
+
+
+class AssetFiles(StaticFiles):
+    """StaticFiles for dist/: picks the .br/.gz sibling the client accepts and
+    marks every hit immutable, since hashed names never change content."""
+
+    async def check_config(self):
+        if self.directory is not None and not os.path.isdir(self.directory):
+            return  # nothing built yet: every lookup is a 404 rather than a 500
+        await super().check_config()
+
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code == 200 and isinstance(response, FileResponse):
+            accepted = Headers(scope=scope).get("accept-encoding", "")
+            for coding, ext in (("br", ".br"), ("gzip", ".gz")):
+                if _accepts(accepted, coding) and os.path.exists(response.path + ext):
+                    response = FileResponse(response.path + ext, media_type=response.media_type,
+                                            headers={"Content-Encoding": coding})
+                    break
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = IMMUTABLE
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["build"]:
+        sys.exit("usage: python assets.py build")
+    entries = build()
+    print(f"{len(entries)} assets written to {DIST}/" + ("" if brotli else " (brotli not installed: gzip only)"))
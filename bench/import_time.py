@@ -0,0 +1,112 @@
+"""Cold-start benchmark: how long `import main` and app startup take.
+
+Each sample is a fresh interpreter, so nothing is warm except the OS page
+cache. Reports the median/min import time, the time to run the lifespan
+startup (schema, migrations, template compile) and the heaviest imports by
+cumulative time, as JSON. --compare REV measures a git revision the same way
+(exported to a temp dir), which is how to show a change's gain:
+
+    python bench/import_time.py
+    python bench/import_time.py --compare HEAD~1 --runs 15
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from login_storm import ROOT
+
+PROBE = r"""
+import sys, time, json, asyncio
+t = time.perf_counter()
+import main
+imported = time.perf_counter() - t
+async def startup():
+    async with main.app.router.lifespan_context(main.app):
+        pass
+t = time.perf_counter()
+asyncio.run(startup())
+started = time.perf_counter() - t
+sys.stdout.write(json.dumps({"import": imported, "startup": started}))
+"""
+
+
+def sample(tree, env):
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=tree, env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise SystemExit(f"probe failed in {tree}:\n{out.stderr[-2000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def heaviest(tree, env, top):
+    """Top-level modules imported by main, by cumulative microseconds (python -X importtime)."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=tree, env=env,
+                         capture_output=True, text=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith("   ") and not name.startswith("    "):  # direct imports of main
+            try:
+                rows.append((name.strip(), int(cumulative)))
+            except ValueError:
+                pass
+    rows.sort(key=lambda r: -r[1])
+    return {name: round(us / 1000, 1) for name, us in rows[:top]}
+
+
+def measure(tree, runs, top):
+    env = dict(os.environ, PYTHONPATH=tree, OPENAI_API_KEY="", GEMINI_API_KEY="", QUIZ_POOL="0",
+               LOG_LEVEL="WARNING")
+    dbdir = tempfile.mkdtemp(prefix="thetamind-import-")
+    try:
+        samples = []
+        for i in range(runs):
+            env["THETAMIND_DB"] = os.path.join(dbdir, f"{i}.db")  # every startup creates the schema from scratch
+            samples.append(sample(tree, env))
+        imports = [s["import"] * 1000 for s in samples]
+        startups = [s["startup"] * 1000 for s in samples]
+        return {
+            "runs": runs,
+            "import_ms_median": round(statistics.median(imports), 1),
+            "import_ms_min": round(min(imports), 1),
+            "startup_ms_median": round(statistics.median(startups), 1),
+            "heaviest_imports_ms": heaviest(tree, env, top),
+        }
+    finally:
+        shutil.rmtree(dbdir, ignore_errors=True)
+
+
+def export(rev):
+    tree = tempfile.mkdtemp(prefix="thetamind-rev-")
+    archive = subprocess.run(["git", "archive", rev], cwd=ROOT, capture_output=True, check=True).stdout
+    subprocess.run(["tar", "-x", "-C", tree], input=archive, check=True)
+    return tree
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--compare", metavar="REV", help="also measure this git revision")
+    args = parser.parse_args()
+
+    result = {"python": sys.version.split()[0], "current": measure(ROOT, args.runs, args.top)}
+    if args.compare:
+        tree = export(args.compare)
+        try:
+            result[args.compare] = measure(tree, args.runs, args.top)
+        finally:
+            shutil.rmtree(tree, ignore_errors=True)
+        before, after = result[args.compare], result["current"]
+        result["import_ms_saved"] = round(before["import_ms_median"] - after["import_ms_median"], 1)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,169 @@
+"""Load test: end-to-end user flows against the mock AI backend.
+
+Every virtual user registers, logs in, then runs --iterations rounds of
+generate quiz -> evaluate answer -> dashboard -> history API, with
+--concurrency users active at once. Prints throughput plus p50/p95/p99 per
+route as JSON, so runs can be diffed over time:
+
+    python bench/loadtest.py                          # in-process, mock AI at 50 ms
+    python bench/loadtest.py --ai-latency 1 --concurrency 64
+    python bench/loadtest.py --url http://127.0.0.1:8000   # a server you started
+    python bench/loadtest.py --out bench/results.jsonl     # also append one line
+
+In-process runs use a throwaway database and never see real provider keys; a
+--url target should be started with OPENAI_API_KEY= GEMINI_API_KEY= and
+MOCK_AI_LATENCY set to get the same mock backend.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import sqlite3
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+
+from login_storm import ROOT, percentile
+
+ROUTES = ("register", "login", "generate_quiz", "evaluate_answer", "dashboard", "history")
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {route: [] for route in ROUTES}
+        self.errors = {route: {} for route in ROUTES}
+
+    async def call(self, route, request, ok=(200,)):
+        t = time.perf_counter()
+        try:
+            response = await request
+        except Exception as e:
+            self._error(route, type(e).__name__)
+            return None
+        self.samples[route].append(time.perf_counter() - t)
+        if response.status_code not in ok:
+            self._error(route, str(response.status_code))
+        return response
+
+    def _error(self, route, kind):
+        self.errors[route][kind] = self.errors[route].get(kind, 0) + 1
+
+    def report(self, elapsed):
+        routes = {}
+        for route, samples in self.samples.items():
+            if not samples and not self.errors[route]:
+                continue
+            routes[route] = {
+                "requests": len(samples),
+                "errors": self.errors[route],
+                "rps": round(len(samples) / elapsed, 2),
+                "p50_ms": round(percentile(samples, 50) * 1000, 2),
+                "p95_ms": round(percentile(samples, 95) * 1000, 2),
+                "p99_ms": round(percentile(samples, 99) * 1000, 2),
+                "max_ms": round(max(samples, default=0) * 1000, 2),
+            }
+        total = sum(len(s) for s in self.samples.values())
+        return {"elapsed_s": round(elapsed, 3), "requests": total, "rps": round(total / elapsed, 2), "routes": routes}
+
+
+async def user_flow(make_client, rec, i, args, rng):
+    name = f"load{args.run_id}_{i}"
+    async with make_client() as client:
+        await rec.call("register", client.post("/register", data={"username": name, "email": f"{name}@x", "password": "pw"}),
+                       ok=(303,))
+        r = await rec.call("login", client.post("/login", data={"username": name, "password": "pw"}), ok=(303,))
+        if r is None or r.status_code != 303:
+            return
+        client.cookies.set("thetamind_user", name)
+        for _ in range(args.iterations):
+            topic, difficulty = rng.choice(args.topics), rng.choice(("Easy", "Medium", "Hard"))
+            r = await rec.call("generate_quiz", client.post("/api/generate_quiz", data={"topic": topic, "difficulty": difficulty}))
+            quiz = r.json() if r is not None and r.status_code == 200 else {}
+            if "question" in quiz:
+                await rec.call("evaluate_answer", client.post("/api/evaluate_answer", data={
+                    "question": quiz["question"], "user_solution": "x = 2", "correct_solution": quiz["solution"],
+                    "topic": topic, "difficulty": difficulty}))
+            await rec.call("dashboard", client.get("/dashboard"))
+            await rec.call("history", client.get("/api/history", params={"limit": 20}))
+
+
+async def run(args):
+    import httpx
+
+    rec = Recorder()
+    rng = random.Random(args.seed)
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def one(i, make_client):
+        async with sem:
+            await user_flow(make_client, rec, i, args, random.Random(rng.random()))
+
+    async def drive(make_client):
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i, make_client) for i in range(args.users)))
+        return time.perf_counter() - start
+
+    timeout = httpx.Timeout(args.timeout)
+    if args.url:
+        elapsed = await drive(lambda: httpx.AsyncClient(base_url=args.url, timeout=timeout))
+    else:
+        import main
+        transport = httpx.ASGITransport(app=main.app)
+        async with main.app.router.lifespan_context(main.app):
+            elapsed = await drive(lambda: httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout))
+    return rec.report(elapsed)
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="target a running server instead of the app in-process")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--ai-latency", type=float, default=0.05, help="mock AI latency in seconds (in-process only)")
+    parser.add_argument("--quiz-pool", choices=("on", "off"), default="on", help="in-process only")
+    parser.add_argument("--topics", nargs="+", default=["Algebra", "Calculus", "Geometry"])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--out", help="append the result as one JSON line to this file")
+    args = parser.parse_args()
+    args.run_id = f"{int(time.time())}_{os.getpid()}"  # fresh usernames when reusing a --url server's database
+
+    if not args.url:
+        os.environ["THETAMIND_DB"] = os.path.join(tempfile.mkdtemp(prefix="thetamind-bench-"), "bench.db")
+        os.environ["OPENAI_API_KEY"] = os.environ["GEMINI_API_KEY"] = ""  # .env must not switch on a real provider
+        os.environ["MOCK_AI_LATENCY"] = str(args.ai_latency)
+        os.environ["QUIZ_POOL"] = "1" if args.quiz_pool == "on" else "0"
+        # measure the app, not the per-user limits: a few simulated users send far more than a student would
+        os.environ["AI_RATE_USER"] = os.environ["AI_RATE_GLOBAL"] = "0"
+        os.chdir(ROOT)
+        sys.path.insert(0, ROOT)
+    with contextlib.redirect_stdout(sys.stderr):  # keep app prints out of the JSON
+        report = asyncio.run(run(args))
+    result = {
+        "target": args.url or "in-process",
+        "config": {k: getattr(args, k) for k in ("users", "concurrency", "iterations", "ai_latency", "quiz_pool", "seed")},
+        "env": environment(),
+        **report,
+    }
+    if args.out:
+        with open(args.out, "a") as f:
+            f.write(json.dumps(result) + "\n")
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,105 @@
+"""Login-storm benchmark.
+
+Fires a burst of concurrent POST /login requests at the app in-process while a
+probe loop keeps hitting GET /about, then prints login throughput and the
+latency of the probe route as JSON. Run it once per mode to compare:
+
+    python bench/login_storm.py --mode pool     # bcrypt on the worker pool
+    python bench/login_storm.py --mode inline   # bcrypt on the event loop
+
+Uses a throwaway database; thetamind.db is never touched.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def storm(args):
+    import httpx
+    import main
+
+    if args.mode == "inline":
+        async def inline(fn, *a):
+            return fn(*a)
+        main.password_pool.run = inline
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for i in range(args.users):
+            await client.post("/register", data={"username": f"bench{i}", "email": f"bench{i}@x", "password": "pw"})
+
+        login_lat, probe_lat, statuses = [], [], {}
+        done = asyncio.Event()
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def login(i):
+            async with sem:
+                t = time.perf_counter()
+                r = await client.post("/login", data={"username": f"bench{i % args.users}", "password": "pw"})
+                login_lat.append(time.perf_counter() - t)
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+        async def probe():
+            while not done.is_set():
+                t = time.perf_counter()
+                await client.get("/about")
+                probe_lat.append(time.perf_counter() - t)
+                await asyncio.sleep(args.probe_interval)
+
+        prober = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(login(i) for i in range(args.logins)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await prober
+
+    ok = statuses.get(303, 0)
+    return {
+        "mode": args.mode,
+        "logins": args.logins,
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "login_ok_per_s": round(ok / elapsed, 2),
+        "status_counts": statuses,
+        "login_p50_ms": round(percentile(login_lat, 50) * 1000, 2),
+        "login_p99_ms": round(percentile(login_lat, 99) * 1000, 2),
+        "probe_requests": len(probe_lat),
+        "probe_p50_ms": round(percentile(probe_lat, 50) * 1000, 2),
+        "probe_p99_ms": round(percentile(probe_lat, 99) * 1000, 2),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=("pool", "inline"), default="pool")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--probe-interval", type=float, default=0.01)
+    args = parser.parse_args()
+
+    os.environ["THETAMIND_DB"] = os.path.join(tempfile.mkdtemp(prefix="thetamind-bench-"), "bench.db")
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    with contextlib.redirect_stdout(sys.stderr):  # keep app prints out of the JSON
+        result = asyncio.run(storm(args))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main_cli()
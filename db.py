@@ -1,7 +1,113 @@
-# db.py  (optional helper file)
+# db.py  (shared data-access layer)
+#
+# One bounded pool of sqlite3 connections per process. Every connection is
+# opened in WAL mode with the pragmas below and keeps its own prepared
+# statement cache, so repeated queries skip the SQL compile step.
+# Async callers go through fetchone/fetchall/execute/run, which hand the work
+# to a thread pool the same size as the connection pool, so a slow disk never
+# blocks the event loop and we never hold more connections than POOL_SIZE.
+import os
+import queue
 import sqlite3
-DB="thetamind.db"
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from telemetry import span
+
+DB = os.getenv("THETAMIND_DB", "thetamind.db")
+POOL_SIZE = int(os.getenv("THETAMIND_DB_POOL", "4"))
+STMT_CACHE = 256
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",   # safe with WAL, skips the fsync per commit
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",     # ~8 MB page cache per connection
+)
+
+
+def _dict_row(cur, row):
+    return {col[0]: row[i] for i, col in enumerate(cur.description)}
+
+
+class Pool:
+    def __init__(self, path=DB, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=STMT_CACHE)
+        conn.row_factory = _dict_row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; blocks while all POOL_SIZE connections are in use."""
+        conn = None
+        with self._lock:
+            if self._idle.empty() and self._opened < self.size:
+                self._opened += 1
+                conn = self._connect()
+        if conn is None:
+            conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="db")
+        return self._executor
+
+    async def run(self, fn, *args):
+        """Run fn(conn, *args) on a pooled connection inside one transaction, off the event loop."""
+        def job():
+            with self.connection() as conn:
+                with conn:
+                    return fn(conn, *args)
+        with span("db"):
+            return await asyncio.get_running_loop().run_in_executor(self.executor(), job)
+
+    async def fetchone(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def execute(self, sql, params=()):
+        """Run a single write and commit it; returns the new rowid."""
+        return await self.run(lambda conn: conn.execute(sql, params).lastrowid)
+
+    async def executemany(self, sql, rows):
+        return await self.run(lambda conn: conn.executemany(sql, rows).rowcount)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._lock:
+            while not self._idle.empty():
+                self._idle.get_nowait().close()
+            self._opened = 0
+
+
+pool = Pool()
+
+
 def init():
-    c=sqlite3.connect(DB)
-    c.execute("CREATE TABLE IF NOT EXISTS sess (id INTEGER PRIMARY KEY,qtxt TEXT,ocrtxt TEXT,ai_res TEXT,ts DATETIME DEFAULT CURRENT_TIMESTAMP)")
-    c.commit(); c.close()
+    with pool.connection() as c:
+        with c:
+            c.execute("CREATE TABLE IF NOT EXISTS sess (id INTEGER PRIMARY KEY,qtxt TEXT,ocrtxt TEXT,ai_res TEXT,ts DATETIME DEFAULT CURRENT_TIMESTAMP)")
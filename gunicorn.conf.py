@@ -0,0 +1,19 @@
+# gunicorn.conf.py  (multi-process deployment: `gunicorn main:app`)
+#
+# One uvicorn worker per core by default. Workers share nothing in memory;
+# whatever has to agree across them goes through the SHARED_STATE backend
+# (see sharedstate.py), which defaults to the SQLite database here.
+import os
+import multiprocessing
+
+os.environ.setdefault("SHARED_STATE", "sqlite")   # inherited by every worker
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))   # streamed AI answers can run long
+graceful_timeout = 30   # lifespan shutdown flushes the write-behind queue
+keepalive = 5
+# Not preloaded: each worker opens its own DB pool, process pools and provider
+# clients, and runs the (idempotent, lock-guarded) schema setup itself.
+preload_app = False
@@ -0,0 +1,84 @@
+# history.py  (paged quiz history and chart series for the JSON API)
+#
+# Pages are keyset-paginated newest first on (ts, id): the cursor is the last
+# row of the previous page, so page N costs the same as page 1. The
+# (user_id, ts) index already ends in the rowid, which is `id`, so it serves
+# the row-value comparison and the ORDER BY without a sort. Chart data comes
+# from the materialized tables in userstats, never from a scan of quiz_history.
+import json
+import base64
+import hashlib
+
+from userstats import CORRECT
+
+BUCKETS = {
+    "day": "day",
+    "week": "strftime('%Y-W%W', day)",
+    "month": "substr(day, 1, 7)",
+}
+
+
+def encode_cursor(ts, row_id):
+    return base64.urlsafe_b64encode(json.dumps([ts, row_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Raises ValueError for anything encode_cursor didn't produce."""
+    try:
+        ts, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("invalid cursor")
+    if not isinstance(ts, str) or not isinstance(row_id, int):
+        raise ValueError("invalid cursor")
+    return ts, row_id
+
+
+def page(conn, user_id, limit=50, cursor=None):
+    """One page of attempts, newest first, plus the cursor for the next page (None on the last)."""
+    where, params = "user_id = ?", [user_id]
+    if cursor:
+        where += " AND (ts, id) < (?, ?)"
+        params += decode_cursor(cursor)
+    rows = conn.execute(f"""
+        SELECT id, topic, difficulty, question, user_solution, {CORRECT} AS is_correct, ts FROM quiz_history
+        WHERE {where} ORDER BY ts DESC, id DESC LIMIT ?
+    """, params + [limit + 1]).fetchall()
+    items = [dict(r, is_correct=bool(r["is_correct"])) for r in rows[:limit]]  # same reading as the charts
+    next_cursor = encode_cursor(items[-1]["ts"], items[-1]["id"]) if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def accuracy(conn, user_id, bucket="day", limit=90, topic=None):
+    """The most recent `limit` buckets of attempts/correct/accuracy, oldest first."""
+    where, params = "user_id = ?", [user_id]
+    if topic:
+        where += " AND topic = ?"
+        params.append(topic)
+    rows = conn.execute(f"""
+        SELECT {BUCKETS[bucket]} AS bucket, SUM(attempts) AS attempts, SUM(correct) AS correct
+        FROM user_daily_stats WHERE {where} GROUP BY 1 ORDER BY 1 DESC LIMIT ?
+    """, params + [limit]).fetchall()
+    return [dict(r, accuracy=round(r["correct"] / r["attempts"], 4)) for r in reversed(rows)]
+
+
+def topics(conn, user_id):
+    """Per-topic totals with a per-difficulty breakdown."""
+    out = {}
+    for r in conn.execute("""
+        SELECT topic, difficulty, is_correct, count FROM user_topic_stats WHERE user_id = ? ORDER BY topic, difficulty
+    """, (user_id,)):
+        t = out.setdefault(r["topic"], {"topic": r["topic"], "attempts": 0, "correct": 0, "difficulties": {}})
+        d = t["difficulties"].setdefault(r["difficulty"], {"attempts": 0, "correct": 0})
+        for totals in (t, d):
+            totals["attempts"] += r["count"]
+            totals["correct"] += r["count"] if r["is_correct"] else 0
+    for t in out.values():
+        for totals in [t, *t["difficulties"].values()]:
+            totals["accuracy"] = round(totals["correct"] / totals["attempts"], 4) if totals["attempts"] else 0.0
+    return list(out.values())
+
+
+def etag(user_id, version, *parts):
+    """Weak ETag for a response derived from a user's history at `version` (see userstats.version)."""
+    digest = hashlib.sha256(json.dumps([user_id, version, *parts]).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
@@ -0,0 +1,76 @@
+# jsonstream.py  (incremental parser for streamed JSON objects)
+import json
+
+
+class FieldStream:
+    """Feed text chunks of one JSON object; get back each top-level field as soon
+    as its value closes.
+
+    >>> p = FieldStream()
+    >>> p.feed('{"is_correct": true, "feedb')
+    [('is_correct', True)]
+    >>> p.feed('ack": "Nice"}')
+    [('feedback', 'Nice')]
+
+    Anything before the first "{" (e.g. a ```json fence) is ignored. Values are
+    decoded with json.loads, so nested objects and arrays come back whole.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key_start = None
+        self._key = None
+        self._value_start = None
+        self.fields = {}
+        self.closed = False
+
+    def feed(self, chunk: str):
+        self.text += chunk
+        out = []
+        text = self.text
+        while self._pos < len(text) and not self.closed:
+            ch = text[self._pos]
+            i = self._pos
+            self._pos += 1
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._key is None and self._key_start is not None:
+                        self._key = json.loads(text[self._key_start:i + 1])
+                continue
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._key is None and self._value_start is None:
+                    self._key_start = i
+                continue
+            if self._depth == 1 and ch == ":" and self._key is not None and self._value_start is None:
+                self._value_start = i + 1
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 1:
+                    self._emit(text[self._value_start:i] if self._value_start is not None else None, out)
+                    self.closed = True
+                self._depth -= 1
+            elif ch == "," and self._depth == 1:
+                self._emit(text[self._value_start:i], out)
+        return out
+
+    def _emit(self, raw, out):
+        if raw is not None and self._key is not None:
+            value = json.loads(raw)
+            self.fields[self._key] = value
+            out.append((self._key, value))
+        self._key = self._key_start = self._value_start = None
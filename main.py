@@ -1,262 +1,842 @@
 # main.py
 import os
 from fastapi import FastAPI, UploadFile, File, Form, Request, Depends, HTTPException, status, Response
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import sqlite3
 import json
+import math
+import time
 import asyncio
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from passlib.context import CryptContext
 from typing import Optional
 from starlette.requests import Request
 from starlette.responses import Response
 
+import db
+import userstats
+import telemetry
+from telemetry import span, log
+import history
+import answercheck
+import assets
+import sharedstate
+from admission import Admission, AdmissionMiddleware, PriorityGate, Overloaded
+from pagecache import PageCache
+from migrations import migrate
+from cache import TTLCache, MISSING
+from workpool import BoundedPool, PoolSaturated
+from aicache import AIResponseCache, SQLiteTier
+from quizpool import QuizPool
+from jsonstream import FieldStream
+from writebehind import WriteBehind
+from ocr import OCRJobs, UploadTooLarge
+from providers import ProviderRouter, ProviderError, OpenAIProvider, GeminiProvider, MockProvider
+
 load_dotenv()
+telemetry.configure_logging()
 
 # --- Configuration ---
-DB = "thetamind.db"
+DB = db.DB
 AI_P = os.getenv("AI_PROVIDER", "openai")
 OPENAI_KEY = os.getenv("OPENAI_API_KEY", "")
 GEMINI_KEY = os.getenv("GEMINI_API_KEY", "")
-
-# This is a fallback for when OPENAI is not configured.
-# We will use a mock AI response.
-IS_AI_CONFIGURED = bool(OPENAI_KEY)
-
-if IS_AI_CONFIGURED:
-    import openai
-    openai.api_key = OPENAI_KEY
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", "16"))
+AI_MODEL = os.getenv("AI_MODEL", "gpt-4-turbo")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "60"))
+AI_RETRIES = int(os.getenv("AI_RETRIES", "2"))
+MOCK_AI_LATENCY = float(os.getenv("MOCK_AI_LATENCY", "1.0"))
+HISTORY_BATCH_ROWS = int(os.getenv("HISTORY_BATCH_ROWS", "50"))
+HISTORY_BATCH_MS = float(os.getenv("HISTORY_BATCH_MS", "50"))
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "2048"))
+AI_CACHE_PERSIST = os.getenv("AI_CACHE_PERSIST", "1") == "1"
+QUIZ_POOL_ENABLED = os.getenv("QUIZ_POOL", "1") == "1"
+QUIZ_POOL_LOW_WATER = int(os.getenv("QUIZ_POOL_LOW_WATER", "5"))
+QUIZ_POOL_TARGET = int(os.getenv("QUIZ_POOL_TARGET", "20"))
+QUIZ_POOL_BATCH = int(os.getenv("QUIZ_POOL_BATCH", "5"))
+QUIZ_POOL_CONCURRENCY = int(os.getenv("QUIZ_POOL_CONCURRENCY", "2"))
+QUIZ_POOL_INTERVAL = float(os.getenv("QUIZ_POOL_INTERVAL", "30"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+OCR_MAX_QUEUE = int(os.getenv("OCR_MAX_QUEUE", "8"))
+OCR_DIR = os.getenv("OCR_DIR", "uploads")
+OCR_MAX_BYTES = int(os.getenv("OCR_MAX_BYTES", str(10 * 1024 * 1024)))
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", "")
+LOCAL_CHECK = os.getenv("LOCAL_CHECK", "1") == "1"
+SHARED_STATE = os.getenv("SHARED_STATE", "memory")   # memory | sqlite | redis://...; gunicorn.conf.py picks sqlite
+SHARED_SYNC_INTERVAL = float(os.getenv("SHARED_SYNC_INTERVAL", "1.0"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+AI_RATE_USER = float(os.getenv("AI_RATE_USER", "0.5"))        # AI requests per second per user; 0 = unlimited
+AI_BURST_USER = int(os.getenv("AI_BURST_USER", "10"))
+AI_RATE_GLOBAL = float(os.getenv("AI_RATE_GLOBAL", "20"))     # across all users and workers
+AI_BURST_GLOBAL = int(os.getenv("AI_BURST_GLOBAL", "60"))
+ADMISSION_CONCURRENCY = int(os.getenv("ADMISSION_CONCURRENCY", "32"))   # per worker
+ADMISSION_QUEUE = int(os.getenv("ADMISSION_QUEUE", "64"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "5"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "50"))   # per worksheet request
+BATCH_MAX_ANSWERS = int(os.getenv("BATCH_MAX_ANSWERS", "50"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))       # AI calls in flight per batch request
+
+# Every provider with a key is used; AI_PROVIDER picks which one is tried
+# first until observed latencies say otherwise. This is a fallback for when
+# no provider is configured: we will use a mock AI response.
+def build_providers():
+    limits = dict(max_concurrency=AI_MAX_CONCURRENCY, timeout=AI_TIMEOUT, retries=AI_RETRIES)
+    providers = []
+    if OPENAI_KEY:
+        providers.append(OpenAIProvider(OPENAI_KEY, model=AI_MODEL, base_url=OPENAI_BASE_URL, **limits))
+    if GEMINI_KEY:
+        providers.append(GeminiProvider(GEMINI_KEY, model=GEMINI_MODEL, **limits))
+    providers.sort(key=lambda p: p.name != AI_P)
+    return providers or [MockProvider(latency=MOCK_AI_LATENCY, max_concurrency=1000)]
+
+ai_router = ProviderRouter(build_providers())
 
 # Password Hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-app = FastAPI(title="thetamind")
+# passlib and its bcrypt backend are imported by the first hash (on a pool
+# thread), not at startup.
+_pwd_context = None
+
+def pwd_context():
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
+
+def _verify(plain_password, hashed_password):
+    return pwd_context().verify(plain_password, hashed_password)
+
+def _hash(password):
+    return pwd_context().hash(password)
+
+# bcrypt costs 100-300 ms of CPU per call; run it off the event loop and shed
+# load with a 503 once HASH_MAX_QUEUE calls are already waiting.
+password_pool = BoundedPool("bcrypt", workers=HASH_WORKERS, max_queue=HASH_MAX_QUEUE)
+# Image preprocessing and Tesseract are CPU-bound for seconds at a time; they
+# run in worker processes (spawned, not forked from this threaded process).
+ocr_pool = BoundedPool("ocr", workers=OCR_WORKERS, max_queue=OCR_MAX_QUEUE,
+                       executor_cls=partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context("spawn")))
+ocr_jobs = OCRJobs(ocr_pool, upload_dir=OCR_DIR, max_bytes=OCR_MAX_BYTES)
+
+# What has to agree across worker processes (see sharedstate.py): user cache
+# invalidations, who refills the quiz pool, and the stats behind /metrics.
+shared_state = sharedstate.from_url(SHARED_STATE)
+coordinator = sharedstate.Coordinator(shared_state, interval=SHARED_SYNC_INTERVAL)
+
+# Token buckets (per user and global) and a priority queue in front of the AI
+# routes; lower priority numbers are admitted first when the queue backs up.
+AI_ROUTES = {
+    "/api/evaluate_answer": ("evaluate", 0),
+    "/api/generate_quiz": ("quiz", 1),
+    "/api/solve_problem": ("solve", 2),
+    "/api/get_lesson": ("lesson", 3),
+    "/api/batch/evaluate_answer": ("evaluate_batch", 0),
+    "/api/batch/generate_quiz": ("quiz_batch", 5),
+}
+admission = Admission(shared_state, PriorityGate(ADMISSION_CONCURRENCY, ADMISSION_QUEUE, ADMISSION_MAX_WAIT), AI_ROUTES,
+                      user_rate=AI_RATE_USER, user_burst=AI_BURST_USER,
+                      global_rate=AI_RATE_GLOBAL, global_burst=AI_BURST_GLOBAL,
+                      resolve=lambda username: cached_user(username))
+
+# Schema work and template compilation happen here rather than at import, so
+# importing main (tests, tooling, worker spawn) stays cheap.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db_init()
+    asset_manifest.load()
+    precompile_templates()
+    history_writer.start()  # started here rather than by the first put, so it isn't tied to that request's spans
+    await coordinator.start()
+    if QUIZ_POOL_ENABLED:
+        quiz_pool.start()
+    yield
+    await quiz_pool.stop()
+    await coordinator.stop()
+    await history_writer.stop()
+    await ocr_jobs.stop()
+    await ai_router.aclose()
+    password_pool.close()
+    ocr_pool.close()
+    db.pool.close()
+
+app = FastAPI(title="thetamind", lifespan=lifespan)
+app.add_middleware(AdmissionMiddleware, admission=admission)
+if telemetry.ENABLED:  # added last so it is outermost and times the 429s too
+    app.add_middleware(telemetry.TimingMiddleware)
 app.mount("/static", StaticFiles(directory="static"), name="static")
+# Fingerprinted copies from `python assets.py build`; templates link them via asset_url()
+app.mount("/assets", assets.AssetFiles(directory=assets.DIST, check_dir=False), name="assets")
+asset_manifest = assets.Manifest()
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["asset_url"] = asset_manifest.url
+# Rendered landing/info pages, one anonymous and one logged-in variant each
+page_cache = PageCache(templates)
+if TEMPLATE_CACHE_DIR:
+    # Compiled template bytecode shared by every worker process and restart
+    from jinja2 import FileSystemBytecodeCache
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+
+def precompile_templates():
+    """Compile every page template into the environment's cache before the first request."""
+    for name in templates.env.list_templates(extensions=["html"]):
+        templates.env.get_template(name)
+
+# Response cache in front of ai_q; per-endpoint policies live in aicache.POLICIES.
+ai_cache = AIResponseCache(memory=TTLCache(maxsize=AI_CACHE_SIZE),
+                           persistent=SQLiteTier() if AI_CACHE_PERSIST else None)
+
+async def generate_quiz_batch(topic: str, difficulty: str, n: int):
+    prompt = f"Generate {n} different math quiz questions on the topic of '{topic}' with a difficulty of '{difficulty}'. Format the response as a JSON object with a single key 'questions' holding a list of objects with keys: 'question', 'solution', 'difficulty'."
+    data = json.loads(await ai_q(prompt, endpoint="quiz_batch"))
+    return data.get("questions", []) if isinstance(data, dict) else []
+
+# Per-(topic, difficulty) question pools kept topped up in the background, so
+# generate_quiz usually skips the LLM round-trip entirely.
+# One worker (the lease holder) does the refilling; the others forward the
+# pools they were asked for.
+quiz_pool = QuizPool(generate_quiz_batch, low_water=QUIZ_POOL_LOW_WATER, target=QUIZ_POOL_TARGET,
+                     batch=QUIZ_POOL_BATCH, concurrency=QUIZ_POOL_CONCURRENCY, interval=QUIZ_POOL_INTERVAL,
+                     leader=lambda: coordinator.holds("quiz_pool"),
+                     forward=lambda wanted, starved: coordinator.broadcast("quiz_pool", [wanted, starved]))
+coordinator.lease("quiz_pool")
+coordinator.on("quiz_pool", lambda m: quiz_pool.merge(*m) if coordinator.holds("quiz_pool") else None)
 
 # --- Database Initialization ---
 def db_init():
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
-    # Users table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        email TEXT UNIQUE NOT NULL,
-        hashed_password TEXT NOT NULL
-    )
-    """)
-    # Quiz History table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS quiz_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        topic TEXT NOT NULL,
-        difficulty TEXT NOT NULL,
-        question TEXT NOT NULL,
-        user_solution TEXT,
-        is_correct BOOLEAN,
-        ts DATETIME DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    """)
-    conn.commit()
-    conn.close()
-
-db_init()
+    with db.pool.connection() as conn, conn:
+        cur = conn.cursor()
+        # Users table
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            hashed_password TEXT NOT NULL
+        )
+        """)
+        # Quiz History table
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS quiz_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            topic TEXT NOT NULL,
+            difficulty TEXT NOT NULL,
+            question TEXT NOT NULL,
+            user_solution TEXT,
+            is_correct BOOLEAN,
+            ts DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        """)
+        if ai_cache.persistent is not None:
+            ai_cache.persistent.init(conn)
+        quiz_pool.init(conn)
+        shared_state.init(conn)
+    db.init()
+    with db.pool.connection() as conn:
+        migrate(conn)
 
 # --- User and Session Management ---
 
-def get_user(username: str):
-    conn = sqlite3.connect(DB)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE username = ?", (username,))
-    user = cur.fetchone()
-    conn.close()
-    return user
+async def get_user(username: str):
+    return await db.pool.fetchone("SELECT * FROM users WHERE username = ?", (username,))
+
+# Cookie username -> users row (or None for unknown names), so authenticated
+# API calls don't pay a DB round-trip each. Entries are dropped on register,
+# login and logout, in every worker; the TTL bounds staleness for anything else.
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+coordinator.on("users", user_cache.invalidate)
 
-def get_current_user(request: Request):
-    username = request.cookies.get("thetamind_user")
+async def invalidate_user(username):
     if username:
-        return get_user(username)
-    return None
+        await coordinator.broadcast("users", username)
+
+async def get_current_user(request: Request):
+    return await cached_user(request.cookies.get("thetamind_user"))
+
+async def cached_user(username):
+    if not username:
+        return None
+    user = user_cache.get(username, MISSING)
+    if user is MISSING:
+        user = await get_user(username)
+        user_cache.set(username, user)
+    return user
+
+async def verify_password(plain_password, hashed_password):
+    with span("bcrypt"):
+        return await password_pool.run(_verify, plain_password, hashed_password)
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def get_password_hash(password):
+    with span("bcrypt"):
+        return await password_pool.run(_hash, password)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+def busy_response(request: Request, template: str):
+    return templates.TemplateResponse(template, {"request": request, "error": "The server is busy, please try again in a moment."},
+                                      status_code=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
 
 # --- AI Interaction ---
-async def ai_q(prompt: str) -> str:
-    """Helper function to call the appropriate AI provider"""
-    if IS_AI_CONFIGURED:
+async def ai_q(prompt: str, endpoint: Optional[str] = None) -> str:
+    """Helper function to call the appropriate AI provider, through the response cache"""
+    with span("ai"):
+        return await ai_cache.get_or_call(endpoint, prompt, ai_router.model_key, lambda: _ai_call(prompt))
+
+async def _ai_call(prompt: str) -> str:
+    try:
+        return await ai_router.complete(prompt)
+    except ProviderError as e:
+        log.warning("AI provider error", extra={"fields": {"error": str(e)}})
+        # Return error in a JSON format that the frontend can handle
+        return json.dumps({"error": f"AI provider error: {e}"})
+
+async def ai_stream(prompt: str, endpoint: Optional[str] = None):
+    """Like ai_q, but yields the completion text in chunks as the provider sends them"""
+    async for chunk in ai_cache.stream_or_call(endpoint, prompt, ai_router.model_key, lambda: _ai_stream_call(prompt)):
+        yield chunk
+
+async def _ai_stream_call(prompt: str):
+    try:
+        async for chunk in ai_router.stream(prompt):
+            yield chunk
+    except ProviderError as e:
+        log.warning("AI provider stream error", extra={"fields": {"error": str(e)}})
+        yield json.dumps({"error": f"AI provider error: {e}"})
+
+
+def stream_fields(chunks, on_complete=None):
+    """NDJSON response for a streamed JSON completion: one {"field", "value"} line
+    per top-level key as soon as it closes, then {"done": true, "result": {...}}.
+    on_complete(result) runs before the final line, e.g. to persist it."""
+    async def body():
+        parser = FieldStream()
         try:
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-4-turbo",
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"Error calling OpenAI: {e}")
-            # Return error in a JSON format that the frontend can handle
-            return json.dumps({"error": f"AI provider error: {e}"})
-
-    # Fallback for demonstration if no API key is set
-    await asyncio.sleep(1)
-    if "Generate a single math quiz question" in prompt:
-         return json.dumps({
-            "question": "If a rectangle has a length of (2x + 1) and a width of (x - 3), what is its area in terms of x?",
-            "solution": "To find the area of a rectangle, you multiply its length by its width. Area = (2x + 1)(x - 3). Using the FOIL method: (2x * x) + (2x * -3) + (1 * x) + (1 * -3) = 2x² - 6x + x - 3. Combine like terms to get the final area: 2x² - 5x - 3.",
-            "difficulty": "Medium"
-        })
-    elif "You are an expert AI Math Tutor" in prompt:
-        return json.dumps({
-            "is_correct": True,
-            "feedback": "Great job! Your method of using the distributive property (FOIL) is perfect for this problem. You correctly multiplied the terms and combined the like terms to arrive at the correct answer.",
-            "smarter_way": "For this type of problem, the FOIL method is the most direct and efficient way to solve it. Keep up the excellent work!"
-        })
-    return json.dumps({"error": "AI provider not configured."})
+            async for chunk in chunks:
+                for key, value in parser.feed(chunk):
+                    yield json.dumps({"field": key, "value": value}) + "\n"
+        except json.JSONDecodeError:
+            parser.closed = False
+        result = parser.fields
+        if not parser.closed or "error" in result:
+            yield json.dumps({"error": result.get("error", "Failed to get a valid response from AI.")}) + "\n"
+            return
+        if on_complete is not None:
+            await on_complete(result)
+        yield json.dumps({"done": True, "result": result}) + "\n"
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+def stream_jobs(jobs, on_complete=None, gate=None):
+    """NDJSON response for a batch: each job is an async () -> [line dicts], run at
+    most BATCH_CONCURRENCY at a time, and its lines go out as soon as it finishes.
+    The last line is {"done": true, **(await on_complete(all lines))}.
+
+    With the admission gate passed in, a job runs on a spare gate slot if one is
+    free and otherwise waits its turn on the slot the request was admitted with,
+    so a batch never holds more of the gate than is idle and can't starve it."""
+    async def bounded(sem, own, job):
+        async with sem:
+            if gate is None:
+                return await job()
+            if gate.try_acquire():
+                try:
+                    return await job()
+                finally:
+                    gate.release()
+            async with own:
+                return await job()
+
+    async def body():
+        sem, own = asyncio.Semaphore(BATCH_CONCURRENCY), asyncio.Lock()
+        tasks = [asyncio.create_task(bounded(sem, own, job)) for job in jobs]
+        lines = []
+        try:
+            for finished in asyncio.as_completed(tasks):
+                for line in await finished:
+                    lines.append(line)
+                    yield json.dumps(line) + "\n"
+            summary = await on_complete(lines) if on_complete is not None else {}
+            yield json.dumps({"done": True, **summary}) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()  # no-op unless the client went away mid-batch
+    return StreamingResponse(body(), media_type="application/x-ndjson")
 
 
 # --- Page Routes ---
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
-    user = get_current_user(request)
-    return templates.TemplateResponse("index.html", {"request": request, "user": user})
+    return page_cache.render(request, "index.html", await get_current_user(request))
 
 @app.get("/register", response_class=HTMLResponse)
 async def register_page(request: Request):
-    return templates.TemplateResponse("register.html", {"request": request})
+    return page_cache.render(request, "register.html")
 
 @app.post("/register")
 async def register_user(request: Request, username: str = Form(...), email: str = Form(...), password: str = Form(...)):
-    print(username, email, password)
-    hashed_password = get_password_hash(password)
-    conn = sqlite3.connect(DB)
-    print(conn)
-    cur = conn.cursor()
     try:
-        cur.execute("INSERT INTO users (username, email, hashed_password) VALUES (?, ?, ?)",
-                    (username, email, hashed_password))
-        conn.commit()
+        hashed_password = await get_password_hash(password)
+    except PoolSaturated:
+        return busy_response(request, "register.html")
+    try:
+        await db.pool.execute("INSERT INTO users (username, email, hashed_password) VALUES (?, ?, ?)",
+                              (username, email, hashed_password))
     except sqlite3.IntegrityError:
         return templates.TemplateResponse("register.html", {"request": request, "error": "Username or email already exists."})
-    finally:
-        conn.close()
+    await invalidate_user(username)
+    log.info("user registered", extra={"fields": {"username": username}})
     return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
 
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request})
+    return page_cache.render(request, "login.html")
 
 @app.post("/login")
 async def login_user(request: Request, username: str = Form(...), password: str = Form(...)):
-    user = get_user(username)
-    print(user)
-    if not user or not verify_password(password, user["hashed_password"]):
+    user = await get_user(username)
+    try:
+        valid = bool(user) and await verify_password(password, user["hashed_password"])
+    except PoolSaturated:
+        return busy_response(request, "login.html")
+    if not valid:
+        log.info("login failed", extra={"fields": {"username": username, "known_user": bool(user)}})
         return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid username or password"})
     
     response = RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
+    await invalidate_user(username)
     response.set_cookie(key="thetamind_user", value=username, httponly=True)
     return response
 
 @app.get("/logout")
 async def logout(request: Request):
+    await invalidate_user(request.cookies.get("thetamind_user"))
     response = RedirectResponse(url="/", status_code=status.HTTP_303_SEE_OTHER)
     response.delete_cookie("thetamind_user")
     return response
 
 @app.get("/tools", response_class=HTMLResponse)
 async def tools_page(request: Request):
-    user = get_current_user(request)
-    return templates.TemplateResponse("tools.html", {"request": request, "user": user})
+    return page_cache.render(request, "tools.html", await get_current_user(request))
 
 @app.get("/algebra", response_class=HTMLResponse)
 async def algebra_page(request: Request):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         return RedirectResponse(url="/login")
     return templates.TemplateResponse("algebra.html", {"request": request, "user": user})
 
 @app.get("/dashboard", response_class=HTMLResponse)
 async def dashboard(request: Request):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         return RedirectResponse(url="/login")
-    
-    conn = sqlite3.connect(DB)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT topic, difficulty, is_correct, COUNT(*) as count FROM quiz_history WHERE user_id = ? GROUP BY topic, difficulty, is_correct", (user["id"],))
-    stats = cur.fetchall()
-    conn.close()
-
-    return templates.TemplateResponse("dashboard.html", {"request": request, "user": user, "stats": stats})
+    # Charts load from the /api/history endpoints, so the page itself doesn't grow with history
+    return templates.TemplateResponse("dashboard.html", {"request": request, "user": user})
 
 @app.get("/about", response_class=HTMLResponse)
 async def about_page(request: Request):
-    user = get_current_user(request)
-    return templates.TemplateResponse("about.html", {"request": request, "user": user})
+    return page_cache.render(request, "about.html", await get_current_user(request))
 
 # --- API Routes ---
 @app.post("/api/generate_quiz")
 async def generate_quiz(request: Request, topic: str = Form(...), difficulty: str = Form(...)):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         return JSONResponse(content={"error": "Authentication required"}, status_code=401)
     
+    if QUIZ_POOL_ENABLED:
+        pooled = await quiz_pool.take(topic, difficulty, user["id"])
+        if pooled:
+            return JSONResponse(content=pooled)
+
     prompt = f"Generate a single math quiz question on the topic of '{topic}' with a difficulty of '{difficulty}'. Format the response as a JSON object with keys: 'question', 'solution', 'difficulty'."
-    ai_response = await ai_q(prompt)
+    ai_response = await ai_q(prompt, endpoint="quiz")
     try:
         return JSONResponse(content=json.loads(ai_response))
     except (json.JSONDecodeError, TypeError):
         return JSONResponse(content={"error": "Failed to generate a valid quiz question from AI."}, status_code=500)
 
 
-@app.post("/api/evaluate_answer")
-async def evaluate_answer(request: Request, question: str = Form(...), user_solution: str = Form(...), correct_solution: str = Form(...), topic: str = Form(...), difficulty: str = Form(...)):
-    user = get_current_user(request)
-    if not user:
-        return JSONResponse(content={"error": "Authentication required"}, status_code=401)
+def _write_history(conn, rows):
+    conn.executemany("""
+        INSERT INTO quiz_history (user_id, topic, difficulty, question, user_solution, is_correct)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, rows)
+    userstats.record(conn, rows)  # same transaction, so the dashboard counts never drift
+
+# Answers are queued and committed in batches (one transaction per
+# HISTORY_BATCH_ROWS rows or HISTORY_BATCH_MS ms); the lifespan hook flushes
+# whatever is left on shutdown.
+history_writer = WriteBehind(db.pool, _write_history, max_rows=HISTORY_BATCH_ROWS,
+                             max_delay=HISTORY_BATCH_MS / 1000, name="quiz_history",
+                             key=lambda row: row[0])  # per user_id, so a history read waits only on its own answers
+
+def _as_bool(value):
+    # The model sometimes answers "true"/"false" as strings
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "yes", "1")
+    return bool(value)
+
+# Answers the local checker can settle (final expression clearly equal, or a
+# bare answer clearly different) skip the model; everything else escalates.
+answer_stats = answercheck.CheckerStats()
 
-    prompt = f"""As an expert AI Math Tutor, evaluate a student's work.
+async def _once(text: str):
+    yield text
+
+async def record_attempt(user_id, topic, difficulty, question, user_solution, is_correct):
+    with span("history"):  # only waits when the write-behind queue is full
+        await history_writer.put((user_id, topic, difficulty, question, user_solution, _as_bool(is_correct)))
+
+def evaluation_prompt(question, user_solution, correct_solution):
+    return f"""As an expert AI Math Tutor, evaluate a student's work.
     Original Question: "{question}"
     Student's Solution: "{user_solution}"
     Correct Solution: "{correct_solution}"
     Analyze the student's process. Identify misconceptions or errors.
     Provide your evaluation as a JSON object with keys: "is_correct" (boolean), "feedback" (constructive paragraph), "smarter_way" (alternative method or encouragement)."""
-    ai_response = await ai_q(prompt)
 
-    try:
-        evaluation = json.loads(ai_response)
-        is_correct = evaluation.get("is_correct", False)
+def check_locally(user_solution, correct_solution):
+    """The evaluation, in the model's shape, when the local checker settles it; else None."""
+    if not LOCAL_CHECK:
+        return None
+    with span("check"):
+        verdict, elapsed = answercheck.timed_check(user_solution, correct_solution)
+    if verdict is None:
+        return None
+    answer_stats.record_local(elapsed)
+    return answercheck.feedback(verdict, user_solution, correct_solution)
 
-        # Save to database
-        conn = sqlite3.connect(DB)
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO quiz_history (user_id, topic, difficulty, question, user_solution, is_correct)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (user["id"], topic, difficulty, question, user_solution, is_correct))
-        conn.commit()
-        conn.close()
+@app.post("/api/evaluate_answer")
+async def evaluate_answer(request: Request, question: str = Form(...), user_solution: str = Form(...), correct_solution: str = Form(...), topic: str = Form(...), difficulty: str = Form(...), stream: bool = Form(False)):
+    user = await get_current_user(request)
+    if not user:
+        return JSONResponse(content={"error": "Authentication required"}, status_code=401)
 
+    prompt = evaluation_prompt(question, user_solution, correct_solution)
+    async def save(evaluation):
+        await record_attempt(user["id"], topic, difficulty, question, user_solution, evaluation.get("is_correct", False))
+
+    evaluation = check_locally(user_solution, correct_solution)
+    if evaluation is not None:
+        if stream:
+            return stream_fields(_once(json.dumps(evaluation)), on_complete=save)
+        await save(evaluation)
         return JSONResponse(content=evaluation)
+
+    start = time.perf_counter()
+    async def save_model(evaluation):
+        answer_stats.record_model(time.perf_counter() - start)
+        await save(evaluation)
+
+    if stream:
+        return stream_fields(ai_stream(prompt, endpoint="evaluate"), on_complete=save_model)
+
+    ai_response = await ai_q(prompt, endpoint="evaluate")
+
+    try:
+        with span("parse"):
+            evaluation = json.loads(ai_response)
     except (json.JSONDecodeError, TypeError):
+        evaluation = None
+    if not isinstance(evaluation, dict) or "error" in evaluation:
+        # a provider failure isn't a wrong answer; like the stream and batch paths, record nothing
         return JSONResponse(content={"error": "Failed to get a valid evaluation from AI."}, status_code=500)
+    await save_model(evaluation)
+    return JSONResponse(content=evaluation)
+
+@app.post("/api/get_lesson")
+async def get_lesson(request: Request, topic: str = Form(...), stream: bool = Form(False)):
+    user = await get_current_user(request)
+    if not user:
+        return JSONResponse(content={"error": "Authentication required"}, status_code=401)
+
+    prompt = f"Explain the following math concept in a clear, concise way suitable for a student: '{topic}'. Format the response as a JSON object with keys: 'title' and 'explanation'."
+    if stream:
+        return stream_fields(ai_stream(prompt, endpoint="lesson"))
+    ai_response = await ai_q(prompt, endpoint="lesson")
+    try:
+        return JSONResponse(content=json.loads(ai_response))
+    except (json.JSONDecodeError, TypeError):
+        return JSONResponse(content={"error": "Failed to generate a valid lesson from AI."}, status_code=500)
+
+# --- Batch API (worksheets) ---
+class QuizBatchItem(BaseModel):
+    topic: str
+    difficulty: str
+    count: int = Field(1, ge=1)
+
+class QuizBatchRequest(BaseModel):
+    items: list[QuizBatchItem]
+
+class AnswerBatchItem(BaseModel):
+    question: str
+    user_solution: str
+    correct_solution: str
+    topic: str
+    difficulty: str
+
+class AnswerBatchRequest(BaseModel):
+    answers: list[AnswerBatchItem]
+
+async def _quiz_chunk(i, item, n, seen):
+    try:
+        questions = await generate_quiz_batch(item.topic, item.difficulty, n)
+    except (json.JSONDecodeError, TypeError, AttributeError):
+        questions = []
+    lines = []
+    for q in questions:
+        if isinstance(q, dict) and q.get("question") and q.get("solution") and q["question"] not in seen:
+            seen.add(q["question"])  # chunks for one item run concurrently; keep the worksheet free of repeats
+            lines.append({"item": i, "question": q["question"], "solution": q["solution"],
+                          "difficulty": q.get("difficulty", item.difficulty), "source": "ai"})
+    return lines or [{"item": i, "error": "Failed to generate valid quiz questions from AI."}]
+
+@app.post("/api/batch/generate_quiz")
+async def batch_generate_quiz(request: Request, batch: QuizBatchRequest):
+    """Stream a worksheet: pooled questions first, the rest from AI prompts of
+    up to QUIZ_POOL_BATCH questions each, one NDJSON line per question."""
+    user = await get_current_user(request)
+    if not user:
+        return JSONResponse(content={"error": "Authentication required"}, status_code=401)
+    requested = sum(item.count for item in batch.items)
+    if not batch.items or requested > BATCH_MAX_QUESTIONS:
+        return JSONResponse(content={"error": f"Ask for between 1 and {BATCH_MAX_QUESTIONS} questions"}, status_code=400)
+
+    # Charge for the worst case, every question from the model, before taking
+    # anything from the pool: a 429 after take() would throw served questions away.
+    prompts = sum(math.ceil(item.count / QUIZ_POOL_BATCH) for item in batch.items)
+    if prompts > 1:
+        try:
+            await admission.charge(user["id"], prompts - 1)  # the request itself paid for one prompt
+        except Overloaded as e:
+            return admission.reject(e)
+
+    ready, jobs = [], []
+    for i, item in enumerate(batch.items):
+        seen = set()
+        while QUIZ_POOL_ENABLED and len(seen) < item.count:
+            pooled = await quiz_pool.take(item.topic, item.difficulty, user["id"])
+            if not pooled or pooled["question"] in seen:
+                break
+            seen.add(pooled["question"])
+            ready.append(dict(pooled, item=i, source="pool"))
+        missing = item.count - len(seen)
+        for start in range(0, missing, QUIZ_POOL_BATCH):
+            jobs.append(partial(_quiz_chunk, i, item, min(QUIZ_POOL_BATCH, missing - start), seen))
+
+    async def from_pool():
+        return ready
+
+    async def summary(lines):
+        return {"requested": requested, "questions": sum("question" in line for line in lines)}
+    return stream_jobs([from_pool] + jobs, on_complete=summary, gate=admission.gate)
+
+@app.post("/api/batch/evaluate_answer")
+async def batch_evaluate_answer(request: Request, batch: AnswerBatchRequest):
+    """Score a worksheet: one NDJSON line per answer as it is evaluated, then
+    every evaluated answer is recorded in a single quiz_history transaction."""
+    user = await get_current_user(request)
+    if not user:
+        return JSONResponse(content={"error": "Authentication required"}, status_code=401)
+    if not batch.answers or len(batch.answers) > BATCH_MAX_ANSWERS:
+        return JSONResponse(content={"error": f"Send between 1 and {BATCH_MAX_ANSWERS} answers"}, status_code=400)
+
+    local = {i: check_locally(a.user_solution, a.correct_solution) for i, a in enumerate(batch.answers)}
+    escalated = [i for i, evaluation in local.items() if evaluation is None]
+    if len(escalated) > 1:
+        try:
+            await admission.charge(user["id"], len(escalated) - 1)
+        except Overloaded as e:
+            return admission.reject(e)
+
+    async def settled(i):
+        return [dict(local[i], index=i)]
+
+    async def ask_model(i):
+        a = batch.answers[i]
+        start = time.perf_counter()
+        try:
+            evaluation = json.loads(await ai_q(evaluation_prompt(a.question, a.user_solution, a.correct_solution), endpoint="evaluate"))
+        except (json.JSONDecodeError, TypeError):
+            evaluation = None
+        if not isinstance(evaluation, dict) or "error" in evaluation:
+            return [{"index": i, "error": "Failed to get a valid evaluation from AI."}]
+        answer_stats.record_model(time.perf_counter() - start)
+        return [dict(evaluation, index=i)]
+
+    async def record(lines):
+        rows = []
+        for line in sorted(lines, key=lambda l: l["index"]):
+            if "error" not in line:
+                a = batch.answers[line["index"]]
+                rows.append((user["id"], a.topic, a.difficulty, a.question, a.user_solution, _as_bool(line.get("is_correct", False))))
+        if rows:
+            with span("history"):
+                await db.pool.run(_write_history, rows)
+        return {"recorded": len(rows), "correct": sum(row[-1] for row in rows)}
+
+    jobs = [partial(settled, i) if local[i] is not None else partial(ask_model, i) for i in range(len(batch.answers))]
+    return stream_jobs(jobs, on_complete=record, gate=admission.gate)
+
+@app.post("/api/solve_problem")
+async def solve_problem(request: Request, problem: str = Form(""), ocr_job: Optional[int] = Form(None), stream: bool = Form(False)):
+    user = await get_current_user(request)
+    if not user:
+        return JSONResponse(content={"error": "Authentication required"}, status_code=401)
+
+    # A finished OCR job can stand in for the typed problem (or be corrected by it)
+    if ocr_job is not None:
+        job = await ocr_jobs.get(user["id"], ocr_job)
+        if job is None:
+            return JSONResponse(content={"error": "OCR job not found"}, status_code=404)
+        if job["status"] != "done":
+            return JSONResponse(content={"error": f"OCR job is {job['status']}"}, status_code=409)
+        problem = problem.strip() or job["text"]
+    if not problem.strip():
+        return JSONResponse(content={"error": "No problem text to solve"}, status_code=400)
+
+    async def save(solution):
+        if ocr_job is not None:
+            await ocr_jobs.save_solution(ocr_job, problem, json.dumps(solution))
+
+    prompt = f"Solve the following math problem and provide a step-by-step explanation: '{problem}'. Format the response as a JSON object with a single key: 'solution'."
+    if stream:
+        return stream_fields(ai_stream(prompt, endpoint="solve"), on_complete=save)
+    ai_response = await ai_q(prompt, endpoint="solve")
+    try:
+        solution = json.loads(ai_response)
+    except (json.JSONDecodeError, TypeError):
+        return JSONResponse(content={"error": "Failed to generate a valid solution from AI."}, status_code=500)
+    await save(solution)
+    return JSONResponse(content=solution)
+
+@app.post("/api/ocr")
+async def upload_problem_image(request: Request, image: UploadFile = File(...)):
+    user = await get_current_user(request)
+    if not user:
+        return JSONResponse(content={"error": "Authentication required"}, status_code=401)
+    if not (image.content_type or "").startswith("image/"):
+        return JSONResponse(content={"error": "Please upload an image file"}, status_code=415)
+    if ocr_pool.pending >= ocr_pool.workers + ocr_pool.max_queue:
+        return JSONResponse(content={"error": "OCR is busy, please try again in a moment."}, status_code=503,
+                            headers={"Retry-After": "5"})
+    try:
+        job = await ocr_jobs.submit(user["id"], image)
+    except UploadTooLarge as e:
+        return JSONResponse(content={"error": str(e)}, status_code=413)
+    return JSONResponse(content=job, status_code=200 if job["status"] == "done" else 202)
+
+@app.get("/api/ocr/{job_id}")
+async def ocr_job_status(request: Request, job_id: int):
+    user = await get_current_user(request)
+    if not user:
+        return JSONResponse(content={"error": "Authentication required"}, status_code=401)
+    job = await ocr_jobs.get(user["id"], job_id)
+    if job is None:
+        return JSONResponse(content={"error": "OCR job not found"}, status_code=404)
+    return job
+
+async def history_json(request: Request, user, build, *parts):
+    """Run build(conn, user_id) unless the client's If-None-Match already holds the current ETag."""
+    await history_writer.drain(user["id"])  # include this user's answers still in the write-behind queue
+    sent = {t.strip() for t in request.headers.get("if-none-match", "").split(",")}
+    def job(conn):
+        tag = history.etag(user["id"], userstats.version(conn, user["id"]), *parts)
+        return tag, None if tag in sent or "*" in sent else build(conn, user["id"])
+    tag, content = await db.pool.run(job)
+    headers = {"ETag": tag, "Cache-Control": "private, no-cache"}
+    if content is None:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=content, headers=headers)
+
+@app.get("/api/history")
+async def api_history(request: Request, limit: int = 50, cursor: Optional[str] = None):
+    user = await get_current_user(request)
+    if not user:
+        return JSONResponse(content={"error": "Authentication required"}, status_code=401)
+    limit = max(1, min(limit, 200))
+    if cursor:
+        try:
+            history.decode_cursor(cursor)
+        except ValueError:
+            return JSONResponse(content={"error": "Invalid cursor"}, status_code=400)
+    return await history_json(request, user, lambda conn, uid: history.page(conn, uid, limit, cursor), "page", limit, cursor)
+
+@app.get("/api/history/accuracy")
+async def api_history_accuracy(request: Request, bucket: str = "day", limit: int = 90, topic: Optional[str] = None):
+    user = await get_current_user(request)
+    if not user:
+        return JSONResponse(content={"error": "Authentication required"}, status_code=401)
+    if bucket not in history.BUCKETS:
+        return JSONResponse(content={"error": f"bucket must be one of {', '.join(history.BUCKETS)}"}, status_code=400)
+    limit = max(1, min(limit, 366))
+    return await history_json(request, user, lambda conn, uid: history.accuracy(conn, uid, bucket, limit, topic),
+                              "accuracy", bucket, limit, topic)
+
+@app.get("/api/history/topics")
+async def api_history_topics(request: Request):
+    user = await get_current_user(request)
+    if not user:
+        return JSONResponse(content={"error": "Authentication required"}, status_code=401)
+    return await history_json(request, user, history.topics, "topics")
+
+def worker_stats():
+    """This worker's in-memory counters; quiz_pool lives in the database and is the same everywhere."""
+    return {"users": user_cache.stats(), "password_pool": password_pool.stats(), "ai": ai_cache.stats(),
+            "history_writer": history_writer.stats(), "ocr": ocr_jobs.stats(), "pages": page_cache.stats(),
+            "answer_checker": answer_stats.stats(), "providers": ai_router.stats(), "admission": admission.stats()}
+
+# Published every SHARED_SYNC_INTERVAL, so any worker can answer for all of them
+coordinator.snapshot = lambda: {"stats": worker_stats(), "metrics": telemetry.registry.snapshot()}
+
+@app.get("/api/cache_stats")
+async def cache_stats():
+    peers = await coordinator.peers()
+    return dict(worker_stats(), quiz_pool=await quiz_pool.stats(), shared_state=coordinator.stats(),
+                peers={worker: snapshot["stats"] for worker, snapshot in sorted(peers.items())})
+
+# Work waiting behind the bounded pools, scraped by /metrics alongside the request histograms
+telemetry.registry.gauge("thetamind_pool_pending", "Jobs running or queued on a bounded worker pool.",
+                         lambda: {"bcrypt": password_pool.pending, "ocr": ocr_pool.pending}, label="pool")
+telemetry.registry.gauge("thetamind_ai_in_flight", "AI provider calls in progress.",
+                         lambda: {p.name: p.in_flight for p in ai_router.providers}, label="provider")
+telemetry.registry.gauge("thetamind_history_queue_depth", "quiz_history rows waiting to be written.",
+                         lambda: history_writer.depth)
+telemetry.registry.gauge("thetamind_admission_queue_depth", "AI requests waiting for an admission slot.",
+                         lambda: admission.gate.depth)
+telemetry.registry.counter("thetamind_admission_rejected_total", "AI requests shed with a 429, by reason.",
+                           lambda: admission.rejected, label="reason")
+telemetry.registry.counter("thetamind_admission_admitted_total", "AI requests admitted, by endpoint.",
+                           lambda: admission.admitted, label="endpoint")
+
+@app.get("/metrics")
+async def metrics():
+    peers = await coordinator.peers()
+    return Response(content=telemetry.registry.render([p["metrics"] for p in peers.values()]), media_type="text/plain; version=0.0.4")
 
 @app.get("/coming_soon", response_class=HTMLResponse)
 async def coming_soon_page(request: Request):
-    user = get_current_user(request)
-    return templates.TemplateResponse("coming_soon.html", {"request": request, "user": user})
+    return page_cache.render(request, "coming_soon.html", await get_current_user(request))
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if WEB_CONCURRENCY > 1:
+        # Workers import main themselves; for production prefer `gunicorn main:app` (gunicorn.conf.py)
+        os.environ.setdefault("SHARED_STATE", "sqlite")
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WEB_CONCURRENCY)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,68 @@
+# migrations.py  (versioned schema changes)
+#
+# Each migration runs once, in order, inside its own transaction, and is
+# recorded in schema_migrations. Add new ones at the end; never edit or
+# renumber one that has shipped. Several workers may start at once: each
+# migration takes the write lock first and re-checks that nobody beat it.
+import userstats
+
+
+def _quiz_history_user_ts_index(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_quiz_history_user_ts ON quiz_history (user_id, ts)")
+
+
+def _user_topic_stats(conn):
+    userstats.create(conn)
+    userstats.rebuild(conn)
+
+
+def _user_daily_stats(conn):
+    userstats.create_daily(conn)
+    userstats.rebuild_daily(conn)
+
+
+def _sess_ocr_jobs(conn):
+    # sess itself comes from db.init(); OCR jobs need an owner, a status and the image hash
+    for column in ("user_id INTEGER", "image_hash TEXT", "status TEXT", "error TEXT"):
+        conn.execute(f"ALTER TABLE sess ADD COLUMN {column}")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_sess_image_hash ON sess (image_hash, status)")
+
+
+def _user_stats_bool_is_correct(conn):
+    # 2 and 3 copied legacy "true"/"false" strings and NULLs into the stats as they were
+    userstats.rebuild(conn)
+    userstats.rebuild_daily(conn)
+
+
+MIGRATIONS = [
+    (1, "quiz_history_user_ts_index", _quiz_history_user_ts_index),
+    (2, "user_topic_stats", _user_topic_stats),
+    (3, "user_daily_stats", _user_daily_stats),
+    (4, "sess_ocr_jobs", _sess_ocr_jobs),
+    (5, "user_stats_bool_is_correct", _user_stats_bool_is_correct),
+]
+
+
+def migrate(conn):
+    """Apply every migration newer than the database; returns the versions applied."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.commit()
+    applied = {row["version"] for row in conn.execute("SELECT version FROM schema_migrations").fetchall()}
+    done = []
+    for version, name, fn in MIGRATIONS:
+        if version in applied:
+            continue
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM schema_migrations WHERE version = ?", (version,)).fetchone():
+                continue  # another worker applied it while we waited for the lock
+            fn(conn)
+            conn.execute("INSERT INTO schema_migrations (version, name) VALUES (?, ?)", (version, name))
+        done.append(version)
+    return done
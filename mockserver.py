@@ -0,0 +1,57 @@
+# mockserver.py  (local OpenAI-compatible server for exercising the provider path)
+#
+#   MOCK_SERVER_LATENCY=0.5 MOCK_SERVER_FAIL_RATE=0.2 uvicorn mockserver:app --port 9000
+#   OPENAI_API_KEY=test OPENAI_BASE_URL=http://127.0.0.1:9000/v1 uvicorn main:app
+#
+# Answers /v1/chat/completions with the same canned responses as the in-process
+# mock provider, either as one JSON body or as SSE deltas when "stream" is set.
+# MOCK_SERVER_FAIL_RATE makes that fraction of requests return 503, to drive
+# the retry and failover logic in providers.py.
+import os
+import json
+import time
+import random
+import asyncio
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from providers import mock_response
+
+LATENCY = float(os.getenv("MOCK_SERVER_LATENCY", "1.0"))
+FAIL_RATE = float(os.getenv("MOCK_SERVER_FAIL_RATE", "0"))
+
+app = FastAPI(title="thetamind mock AI")
+app.state.requests = 0
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    app.state.requests += 1
+    body = await request.json()
+    if random.random() < FAIL_RATE:
+        return JSONResponse({"error": {"message": "injected failure"}}, status_code=503)
+
+    prompt = body["messages"][-1]["content"]
+    text = mock_response(prompt)
+    base = {"id": f"mock-{app.state.requests}", "created": int(time.time()), "model": body.get("model", "mock")}
+
+    if not body.get("stream"):
+        await asyncio.sleep(LATENCY)
+        return dict(base, object="chat.completion", choices=[
+            {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}])
+
+    async def events():
+        await asyncio.sleep(LATENCY * 0.2)
+        for i in range(0, len(text), 24):
+            await asyncio.sleep(LATENCY * 0.8 * 24 / len(text))
+            chunk = dict(base, object="chat.completion.chunk", choices=[
+                {"index": 0, "delta": {"content": text[i:i + 24]}, "finish_reason": None}])
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def stats():
+    return {"requests": app.state.requests}
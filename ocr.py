@@ -0,0 +1,153 @@
+# ocr.py  (photographed problems -> text, off the event loop)
+#
+# An upload is streamed to OCR_DIR while it is hashed, then becomes a row in
+# `sess` (status queued -> running -> done | failed) that clients poll. The
+# image work (downscale, grayscale, threshold, Tesseract) runs in a
+# BoundedPool of worker processes, so it never holds the GIL the event loop
+# needs. Finished rows double as a cache keyed by the image's sha256: a
+# re-upload of the same bytes is answered from `sess` without running OCR, and
+# identical uploads in flight at the same time share one OCR run.
+import os
+import uuid
+import hashlib
+import asyncio
+
+import aiofiles
+
+import db
+from singleflight import SingleFlight
+from workpool import PoolSaturated
+from telemetry import log
+
+MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2000"))
+LANG = os.getenv("OCR_LANG", "eng")
+CHUNK = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+# --- Worker side (runs in the process pool) ---
+def _otsu(histogram):
+    """Threshold that best separates a 256-bin histogram into two classes."""
+    total = sum(histogram)
+    weighted = sum(i * n for i, n in enumerate(histogram))
+    best, best_var, seen, seen_weighted = 127, -1.0, 0, 0.0
+    for t, n in enumerate(histogram):
+        seen += n
+        if seen == 0 or seen == total:
+            continue
+        seen_weighted += t * n
+        mean_low = seen_weighted / seen
+        mean_high = (weighted - seen_weighted) / (total - seen)
+        var = seen * (total - seen) * (mean_low - mean_high) ** 2
+        if var > best_var:
+            best, best_var = t, var
+    return best
+
+
+def preprocess(path, max_side=MAX_SIDE):
+    """Upright, downscaled, black-on-white version of the photo."""
+    from PIL import Image, ImageOps
+    with Image.open(path) as im:
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((max_side, max_side))
+        gray = ImageOps.autocontrast(im.convert("L"))
+    cut = _otsu(gray.histogram())
+    return gray.point(lambda p: 255 if p > cut else 0, mode="1")
+
+
+def extract(path, lang=LANG):
+    import pytesseract
+    return pytesseract.image_to_string(preprocess(path), lang=lang).strip()
+
+
+# --- Async side ---
+class OCRJobs:
+    def __init__(self, workers, pool=db.pool, upload_dir="uploads", max_bytes=10 * 1024 * 1024):
+        self.workers = workers            # BoundedPool, normally over a ProcessPoolExecutor
+        self.pool = pool
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.flights = SingleFlight()
+        self._tasks = set()
+        self.cache_hits = 0
+        self.completed = 0
+        self.failed = 0
+
+    async def save(self, upload):
+        """Stream an UploadFile to disk; returns (path, sha256 hex). Raises UploadTooLarge."""
+        os.makedirs(self.upload_dir, exist_ok=True)
+        path = os.path.abspath(os.path.join(self.upload_dir, uuid.uuid4().hex))
+        digest, size = hashlib.sha256(), 0
+        try:
+            async with aiofiles.open(path, "wb") as f:
+                while chunk := await upload.read(CHUNK):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLarge(f"image is larger than {self.max_bytes} bytes")
+                    digest.update(chunk)
+                    await f.write(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path, digest.hexdigest()
+
+    async def submit(self, user_id, upload):
+        """Create a job for an uploaded image. Returns the job dict; OCR runs in the background."""
+        path, image_hash = await self.save(upload)
+        cached = await self.pool.fetchone(
+            "SELECT ocrtxt FROM sess WHERE image_hash = ? AND status = 'done' ORDER BY id DESC LIMIT 1", (image_hash,))
+        if cached:
+            os.remove(path)
+            self.cache_hits += 1
+            job_id = await self.pool.execute(
+                "INSERT INTO sess (user_id, image_hash, status, ocrtxt) VALUES (?, ?, 'done', ?)",
+                (user_id, image_hash, cached["ocrtxt"]))
+            return {"job_id": job_id, "status": "done", "text": cached["ocrtxt"], "cached": True}
+        job_id = await self.pool.execute("INSERT INTO sess (user_id, image_hash, status) VALUES (?, ?, 'queued')",
+                                         (user_id, image_hash))
+        task = asyncio.create_task(self._process(job_id, image_hash, path))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return {"job_id": job_id, "status": "queued", "text": None, "cached": False}
+
+    async def _process(self, job_id, image_hash, path):
+        await self.pool.execute("UPDATE sess SET status = 'running' WHERE id = ?", (job_id,))
+        try:
+            text = await self.flights.do(image_hash, lambda: self.workers.run(extract, path))
+        except PoolSaturated:
+            await self._fail(job_id, "OCR is busy, please try again in a moment.")
+        except Exception as e:
+            log.warning("OCR failed", extra={"fields": {"job_id": job_id, "error": str(e)}})
+            await self._fail(job_id, f"Could not read the image: {e}")
+        else:
+            self.completed += 1
+            await self.pool.execute("UPDATE sess SET status = 'done', ocrtxt = ? WHERE id = ?", (text, job_id))
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def _fail(self, job_id, error):
+        self.failed += 1
+        await self.pool.execute("UPDATE sess SET status = 'failed', error = ? WHERE id = ?", (error, job_id))
+
+    async def get(self, user_id, job_id):
+        row = await self.pool.fetchone("SELECT id, status, ocrtxt, error FROM sess WHERE id = ? AND user_id = ?",
+                                       (job_id, user_id))
+        if row is None:
+            return None
+        return {"job_id": row["id"], "status": row["status"], "text": row["ocrtxt"], "error": row["error"]}
+
+    async def save_solution(self, job_id, problem, response):
+        await self.pool.execute("UPDATE sess SET qtxt = ?, ai_res = ? WHERE id = ?", (problem, response, job_id))
+
+    async def stop(self):
+        """Let jobs already handed to the workers finish."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self):
+        return {"in_flight": len(self._tasks), "cache_hits": self.cache_hits, "completed": self.completed,
+                "failed": self.failed, "workers": self.workers.stats()}
@@ -0,0 +1,45 @@
+# pagecache.py  (rendered HTML for pages that only depend on being logged in)
+#
+# The landing/info pages render the same bytes for every anonymous visitor and
+# the same bytes for every logged-in one (their templates only branch on
+# `{% if user %}`). PageCache keeps one rendered body per (template, variant)
+# with a content ETag, so a hit is a dict lookup and a revalidation is a 304.
+# An entry is reused only while Jinja hands back the same compiled template,
+# so an edited template (auto_reload) or a restart on deploy re-renders it.
+# Templates served through here must not print per-user data.
+import hashlib
+
+from starlette.responses import HTMLResponse, Response
+
+
+class PageCache:
+    def __init__(self, templates):
+        self.templates = templates
+        self._entries = {}   # (name, variant) -> (template, body, etag)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def render(self, request, name, user=None):
+        variant = "user" if user else "anon"
+        template = self.templates.get_template(name)
+        entry = self._entries.get((name, variant))
+        if entry is None or entry[0] is not template:
+            self.misses += 1
+            body = template.render({"request": request, "user": user}).encode("utf-8")
+            entry = self._entries[(name, variant)] = (template, body, f'"{hashlib.sha256(body).hexdigest()[:20]}"')
+        else:
+            self.hits += 1
+        _, body, etag = entry
+        # Vary: Cookie because the same URL has a logged-in variant
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Cookie"}
+        if etag in {t.strip() for t in request.headers.get("if-none-match", "").split(",")}:
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return HTMLResponse(body, headers=headers)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "not_modified": self.not_modified}
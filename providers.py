@@ -0,0 +1,377 @@
+# providers.py  (AI provider clients and failover routing)
+#
+# Each provider owns one keep-alive httpx.AsyncClient, a semaphore capping
+# in-flight upstream requests, a per-request timeout and retries with jittered
+# exponential backoff. ProviderRouter tries providers fastest-first (by a
+# moving average of observed latency) and skips any that recently failed.
+# httpx is only imported once a real provider makes its first request, so
+# startup (and the mock backend) never pays for it.
+import json
+import time
+import random
+import asyncio
+
+
+class ProviderError(Exception):
+    pass
+
+
+class RetryableError(ProviderError):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def _retryable():
+    """Exception types worth another attempt (evaluated only when something was raised)."""
+    import httpx
+    return (RetryableError, httpx.TimeoutException, httpx.TransportError)
+
+
+class Provider:
+    name = "base"
+
+    def __init__(self, model, max_concurrency=8, timeout=60.0, retries=2, backoff=0.5,
+                 queue_timeout=5.0, cooldown=30.0, failure_threshold=3):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.queue_timeout = queue_timeout
+        self.cooldown = cooldown
+        self.failure_threshold = failure_threshold
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self._client = None
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.retried = 0
+        self.ewma = None
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    # --- HTTP ---
+    def client(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=5.0),
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @staticmethod
+    def _check(response):
+        if response.status_code in RETRY_STATUSES:
+            retry_after = response.headers.get("retry-after")
+            raise RetryableError(f"HTTP {response.status_code}",
+                                 float(retry_after) if retry_after and retry_after.isdigit() else None)
+        if response.status_code >= 400:
+            raise ProviderError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+    # --- Health ---
+    @property
+    def available(self):
+        return time.monotonic() >= self.cooldown_until
+
+    def _record(self, ok, elapsed=None):
+        if ok:
+            self.consecutive_failures = 0
+            self.ewma = elapsed if self.ewma is None else 0.8 * self.ewma + 0.2 * elapsed
+        else:
+            self.errors += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.cooldown_until = time.monotonic() + self.cooldown
+
+    def _delay(self, attempt, retry_after=None):
+        delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+        return min(retry_after, 30.0) if retry_after else delay
+
+    async def _slot(self):
+        try:
+            await asyncio.wait_for(self._sem.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise ProviderError(f"{self.name}: all {self.max_concurrency} slots busy")
+
+    # --- Calls ---
+    async def complete(self, prompt: str) -> str:
+        await self._slot()
+        self.in_flight += 1
+        self.calls += 1
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    text = await self._complete(prompt)
+                    self._record(True, time.perf_counter() - start)
+                    return text
+                except _retryable() as e:
+                    if attempt == self.retries:
+                        raise ProviderError(f"{self.name}: {e!r}") from e
+                    self.retried += 1
+                    await asyncio.sleep(self._delay(attempt, getattr(e, "retry_after", None)))
+        except Exception as e:
+            self._record(False)
+            if isinstance(e, ProviderError):
+                raise
+            raise ProviderError(f"{self.name}: {e!r}") from e
+        finally:
+            self.in_flight -= 1
+            self._sem.release()
+
+    async def stream(self, prompt: str):
+        """Yield text deltas. Retries only happen before the first delta is sent."""
+        await self._slot()
+        self.in_flight += 1
+        self.calls += 1
+        start = time.perf_counter()
+        sent = False
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    async for delta in self._stream(prompt):
+                        sent = True
+                        yield delta
+                    self._record(True, time.perf_counter() - start)
+                    return
+                except _retryable() as e:
+                    if sent or attempt == self.retries:
+                        raise ProviderError(f"{self.name}: {e!r}") from e
+                    self.retried += 1
+                    await asyncio.sleep(self._delay(attempt, getattr(e, "retry_after", None)))
+        except Exception as e:
+            self._record(False)
+            if isinstance(e, ProviderError):
+                raise
+            raise ProviderError(f"{self.name}: {e!r}") from e
+        finally:
+            self.in_flight -= 1
+            self._sem.release()
+
+    async def _complete(self, prompt):
+        raise NotImplementedError
+
+    async def _stream(self, prompt):
+        yield await self._complete(prompt)
+
+    def stats(self):
+        return {
+            "model": self.model,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "calls": self.calls,
+            "errors": self.errors,
+            "retried": self.retried,
+            "latency_ms": round(self.ewma * 1000, 1) if self.ewma is not None else None,
+            "available": self.available,
+        }
+
+
+async def _sse_data(response):
+    """Yield the payload of each `data:` line of a server-sent-events response."""
+    async for line in response.aiter_lines():
+        if line.startswith("data:"):
+            data = line[5:].strip()
+            if data and data != "[DONE]":
+                yield data
+
+
+class OpenAIProvider(Provider):
+    """Chat Completions over plain HTTP; base_url also works for OpenAI-compatible servers."""
+    name = "openai"
+
+    def __init__(self, api_key, model="gpt-4-turbo", base_url="https://api.openai.com/v1", **kwargs):
+        super().__init__(model, **kwargs)
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+
+    def _request(self, prompt, stream=False):
+        body = {"model": self.model, "messages": [{"role": "user", "content": prompt}]}
+        if stream:
+            body["stream"] = True
+        return self.client().build_request("POST", f"{self.base_url}/chat/completions", json=body,
+                                           headers={"Authorization": f"Bearer {self.api_key}"})
+
+    async def _complete(self, prompt):
+        response = await self.client().send(self._request(prompt))
+        self._check(response)
+        return response.json()["choices"][0]["message"]["content"]
+
+    async def _stream(self, prompt):
+        response = await self.client().send(self._request(prompt, stream=True), stream=True)
+        try:
+            if response.status_code >= 400:
+                await response.aread()
+            self._check(response)
+            async for data in _sse_data(response):
+                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+        finally:
+            await response.aclose()
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+
+    def __init__(self, api_key, model="gemini-1.5-flash",
+                 base_url="https://generativelanguage.googleapis.com/v1beta", **kwargs):
+        super().__init__(model, **kwargs)
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+
+    @staticmethod
+    def _text(payload):
+        candidates = payload.get("candidates") or [{}]
+        parts = candidates[0].get("content", {}).get("parts", [])
+        return "".join(part.get("text", "") for part in parts)
+
+    def _request(self, prompt, method):
+        body = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+        params = {"key": self.api_key}
+        if method == "streamGenerateContent":
+            params["alt"] = "sse"
+        return self.client().build_request("POST", f"{self.base_url}/models/{self.model}:{method}",
+                                           json=body, params=params)
+
+    async def _complete(self, prompt):
+        response = await self.client().send(self._request(prompt, "generateContent"))
+        self._check(response)
+        return self._text(response.json())
+
+    async def _stream(self, prompt):
+        response = await self.client().send(self._request(prompt, "streamGenerateContent"), stream=True)
+        try:
+            if response.status_code >= 400:
+                await response.aread()
+            self._check(response)
+            async for data in _sse_data(response):
+                delta = self._text(json.loads(data))
+                if delta:
+                    yield delta
+        finally:
+            await response.aclose()
+
+
+class MockProvider(Provider):
+    """In-process stand-in used when no API key is configured (and by the benchmarks)."""
+    name = "mock"
+
+    def __init__(self, latency=1.0, **kwargs):
+        super().__init__("mock", **kwargs)
+        self.latency = latency
+
+    async def _complete(self, prompt):
+        await asyncio.sleep(self.latency)
+        return mock_response(prompt)
+
+    async def _stream(self, prompt):
+        # Same answers, dribbled out over roughly the same latency
+        text = mock_response(prompt)
+        await asyncio.sleep(self.latency * 0.2)
+        for i in range(0, len(text), 24):
+            await asyncio.sleep(self.latency * 0.8 * 24 / len(text))
+            yield text[i:i + 24]
+
+
+class ProviderRouter:
+    """Sends each call to the fastest available provider, failing over down the list."""
+
+    def __init__(self, providers):
+        self.providers = list(providers)
+        self.failovers = 0
+
+    @property
+    def model_key(self):
+        return ",".join(f"{p.name}:{p.model}" for p in self.providers)
+
+    def ranked(self):
+        # Cooling-down providers go last; untried ones count as fastest so they get measured.
+        order = {id(p): i for i, p in enumerate(self.providers)}
+        return sorted(self.providers, key=lambda p: (not p.available, p.ewma or 0.0, order[id(p)]))
+
+    async def complete(self, prompt):
+        errors = []
+        for i, provider in enumerate(self.ranked()):
+            if i:
+                self.failovers += 1
+            try:
+                return await provider.complete(prompt)
+            except ProviderError as e:
+                errors.append(str(e))
+        raise ProviderError("; ".join(errors) or "no providers configured")
+
+    async def stream(self, prompt):
+        errors = []
+        for i, provider in enumerate(self.ranked()):
+            if i:
+                self.failovers += 1
+            sent = False
+            try:
+                async for delta in provider.stream(prompt):
+                    sent = True
+                    yield delta
+                return
+            except ProviderError as e:
+                if sent:
+                    raise
+                errors.append(str(e))
+        raise ProviderError("; ".join(errors) or "no providers configured")
+
+    async def aclose(self):
+        for provider in self.providers:
+            await provider.aclose()
+
+    def stats(self):
+        return {"failovers": self.failovers, "providers": [dict(p.stats(), name=p.name) for p in self.providers]}
+
+
+# --- Mock responses ---
+def mock_quiz_question():
+    a, b, c = random.randint(2, 5), random.randint(1, 9), random.randint(1, 9)
+    middle = b - a * c
+    sign = "+" if middle >= 0 else "-"
+    return {
+        "question": f"If a rectangle has a length of ({a}x + {b}) and a width of (x - {c}), what is its area in terms of x?",
+        "solution": f"Area = ({a}x + {b})(x - {c}) = {a}x² {sign} {abs(middle)}x - {b * c}.",
+        "difficulty": "Medium"
+    }
+
+
+def mock_response(prompt: str) -> str:
+    if "different math quiz questions" in prompt:
+        n = int(prompt.split("Generate ", 1)[1].split(" ", 1)[0])
+        return json.dumps({"questions": [mock_quiz_question() for _ in range(n)]})
+    elif "Generate a single math quiz question" in prompt:
+        return json.dumps({
+            "question": "If a rectangle has a length of (2x + 1) and a width of (x - 3), what is its area in terms of x?",
+            "solution": "To find the area of a rectangle, you multiply its length by its width. Area = (2x + 1)(x - 3). Using the FOIL method: (2x * x) + (2x * -3) + (1 * x) + (1 * -3) = 2x² - 6x + x - 3. Combine like terms to get the final area: 2x² - 5x - 3.",
+            "difficulty": "Medium"
+        })
+    elif "expert AI Math Tutor" in prompt:
+        return json.dumps({
+            "is_correct": True,
+            "feedback": "Great job! Your method of using the distributive property (FOIL) is perfect for this problem. You correctly multiplied the terms and combined the like terms to arrive at the correct answer.",
+            "smarter_way": "For this type of problem, the FOIL method is the most direct and efficient way to solve it. Keep up the excellent work!"
+        })
+    elif "Explain the following math concept" in prompt:
+        return json.dumps({
+            "title": "The FOIL Method",
+            "explanation": "FOIL stands for First, Outer, Inner, Last. It's a mnemonic for multiplying two binomials. For (a+b)(c+d), you multiply: First terms (a*c), Outer terms (a*d), Inner terms (b*c), and Last terms (b*d), then sum them up."
+        })
+    elif "Solve the following math problem" in prompt:
+        return json.dumps({
+            "solution": "To factor x² - 5x + 6, you look for two numbers that multiply to 6 and add to -5. These numbers are -2 and -3. So, the factored form is (x - 2)(x - 3)."
+        })
+    return json.dumps({"error": "AI provider not configured."})
@@ -0,0 +1,221 @@
+# quizpool.py  (pre-generated quiz questions with background refill)
+#
+# Questions live in the quiz_pool table, one pool per (topic, difficulty).
+# generate_quiz serves from the pool, skipping questions the user already has
+# in quiz_history; each question is retired after max_serves uses. A background
+# task keeps every pool it knows about at or above low_water by asking the AI
+# for `batch` questions at a time until the pool is back at `target`.
+# Topics are free-form client strings, so only the max_wanted pools requested
+# most recently (within wanted_ttl) are refilled, and a pool whose last batch
+# added nothing is left alone for a doubling backoff (up to max_backoff).
+# With several workers only the one for which leader() is true refills; the
+# others pass the pools they were asked for to forward(wanted, starved),
+# which hands them to the leader's merge().
+import time
+import asyncio
+
+import db
+from telemetry import log
+
+
+class QuizPool:
+    def __init__(self, generate, pool=db.pool, low_water=5, target=20, batch=5,
+                 max_serves=30, concurrency=2, interval=30.0, leader=None, forward=None,
+                 max_wanted=200, wanted_ttl=3600.0, max_backoff=3600.0):
+        self.generate = generate          # async (topic, difficulty, n) -> [{"question", "solution", "difficulty"}]
+        self.pool = pool
+        self.low_water = low_water
+        self.target = target
+        self.batch = batch
+        self.max_serves = max_serves
+        self.concurrency = concurrency
+        self.interval = interval
+        self.leader = leader              # () -> bool; None means this process always refills
+        self.forward = forward            # async (wanted, starved) -> None, used while not leader
+        self.max_wanted = max_wanted
+        self.wanted_ttl = wanted_ttl
+        self.max_backoff = max_backoff
+        self._wanted = {}                 # (topic, difficulty) -> monotonic time last requested
+        self._starved = set()
+        self._backoff = {}                # (topic, difficulty) -> (retry at, consecutive empty batches)
+        self._wake = asyncio.Event()
+        self._task = None
+        self.served = 0
+        self.fallbacks = 0
+        self.generated = 0
+        self.refill_batches = 0
+        self.refill_errors = 0
+        self.last_refill = None
+
+    def init(self, conn):
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS quiz_pool (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT NOT NULL,
+            difficulty TEXT NOT NULL,
+            question TEXT NOT NULL,
+            solution TEXT NOT NULL,
+            served INTEGER NOT NULL DEFAULT 0,
+            created DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (topic, difficulty, question)
+        )
+        """)
+
+    # --- Serving ---
+    async def take(self, topic, difficulty, user_id):
+        """Pop a question this user hasn't answered yet, or None if the pool can't serve one."""
+        def job(conn):
+            row = conn.execute("""
+                SELECT id, question, solution FROM quiz_pool
+                WHERE topic = ? AND difficulty = ? AND served < ?
+                  AND question NOT IN (SELECT question FROM quiz_history WHERE user_id = ? AND topic = ? AND difficulty = ?)
+                ORDER BY served, id LIMIT 1
+            """, (topic, difficulty, self.max_serves, user_id, topic, difficulty)).fetchone()
+            if row:
+                conn.execute("UPDATE quiz_pool SET served = served + 1 WHERE id = ?", (row["id"],))
+            depth = conn.execute("SELECT COUNT(*) AS n FROM quiz_pool WHERE topic = ? AND difficulty = ? AND served < ?",
+                                 (topic, difficulty, self.max_serves)).fetchone()["n"]
+            return row, depth
+        row, depth = await self.pool.run(job)
+        key = (topic, difficulty)
+        if row is None:
+            self.fallbacks += 1
+            self._starved.add(key)  # this user has seen everything; top up even above low_water
+        if row is None or depth < self.low_water or key not in self._wanted:
+            self.want(topic, difficulty)
+        else:
+            self._wanted[key] = time.monotonic()
+        if row is None:
+            return None
+        self.served += 1
+        return {"question": row["question"], "solution": row["solution"], "difficulty": difficulty}
+
+    def want(self, topic, difficulty):
+        """Register a pool and nudge the refill task to look at it."""
+        self._note((topic, difficulty))
+        self._wake.set()
+
+    def merge(self, wanted, starved):
+        """Take on pools another worker was asked for (see forward)."""
+        for key in map(tuple, wanted):
+            self._note(key)
+        self._starved.update(key for key in map(tuple, starved) if key in self._wanted)
+        self._wake.set()
+
+    def _note(self, key):
+        if key not in self._wanted and len(self._wanted) >= self.max_wanted:
+            stalest = min(self._wanted, key=self._wanted.get)
+            del self._wanted[stalest]
+            self._starved.discard(stalest)
+        self._wanted[key] = time.monotonic()
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.wanted_ttl
+        for key in [k for k, t in self._wanted.items() if t < cutoff]:
+            del self._wanted[key]
+            self._starved.discard(key)
+            self._backoff.pop(key, None)
+
+    def _empty_batch(self, key):
+        """Back off a pool whose provider call failed or brought nothing new."""
+        _, failures = self._backoff.get(key, (0, 0))
+        delay = min(self.interval * 2 ** failures, self.max_backoff)
+        self._backoff[key] = (time.monotonic() + delay, failures + 1)
+
+    # --- Refill ---
+    async def depths(self):
+        rows = await self.pool.fetchall("SELECT topic, difficulty, COUNT(*) AS depth FROM quiz_pool WHERE served < ? GROUP BY topic, difficulty",
+                                        (self.max_serves,))
+        found = {(r["topic"], r["difficulty"]): r["depth"] for r in rows}
+        return {key: found.get(key, 0) for key in set(found) | set(self._wanted)}
+
+    async def _add(self, topic, difficulty, items):
+        rows = [(topic, difficulty, i["question"], i["solution"]) for i in items
+                if isinstance(i, dict) and i.get("question") and i.get("solution")]
+        def job(conn):
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO quiz_pool (topic, difficulty, question, solution) VALUES (?, ?, ?, ?)", rows)
+            return conn.total_changes - before
+        return await self.pool.run(job) if rows else 0
+
+    async def refill(self, topic, difficulty, depth):
+        """Generate batches until the pool reaches target, or a batch adds nothing new."""
+        key = (topic, difficulty)
+        while depth < self.target:
+            try:
+                items = await self.generate(topic, difficulty, min(self.batch, self.target - depth))
+            except Exception as e:
+                self.refill_errors += 1
+                log.warning("quiz pool refill failed", extra={"fields": {"topic": topic, "difficulty": difficulty, "error": str(e)}})
+                self._empty_batch(key)
+                return
+            added = await self._add(topic, difficulty, items)
+            self.refill_batches += 1
+            self.generated += added
+            self.last_refill = time.time()
+            if not added:
+                self._empty_batch(key)
+                return
+            self._backoff.pop(key, None)
+            depth += added
+
+    async def refill_once(self):
+        sem = asyncio.Semaphore(self.concurrency)
+        async def one(key, depth):
+            async with sem:
+                await self.refill(key[0], key[1], depth)
+        starved, self._starved = self._starved, set()
+        now = time.monotonic()
+        depths = {key: depth for key, depth in (await self.depths()).items()
+                  if key in self._wanted and self._backoff.get(key, (0, 0))[0] <= now}
+        low = [(key, depth) for key, depth in depths.items() if depth < self.low_water]
+        low += [(key, min(depth, self.target - self.batch)) for key, depth in depths.items()
+                if key in starved and depth >= self.low_water]
+        await asyncio.gather(*(one(key, depth) for key, depth in low))
+
+    async def _run(self):
+        while True:
+            try:
+                self._expire()
+                if self.leader is None or self.leader():
+                    await self.refill_once()
+                elif self.forward is not None and self._wanted:
+                    starved, self._starved = self._starved, set()
+                    await self.forward(sorted(self._wanted), sorted(starved))
+            except Exception:
+                log.exception("quiz pool refill loop error")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def stats(self):
+        depths = await self.depths()
+        return {
+            "low_water": self.low_water,
+            "target": self.target,
+            "batch": self.batch,
+            "served": self.served,
+            "fallbacks": self.fallbacks,
+            "generated": self.generated,
+            "refill_batches": self.refill_batches,
+            "refill_errors": self.refill_errors,
+            "last_refill": self.last_refill,
+            "depths": {f"{t}/{d}": n for (t, d), n in sorted(depths.items())},
+            "wanted": len(self._wanted),
+            "backing_off": sum(until > time.monotonic() for until, _ in self._backoff.values()),
+        }
@@ -0,0 +1,451 @@
+# sharedstate.py  (state that has to agree across worker processes)
+#
+# Under gunicorn every worker has its own memory: caches, counters and
+# background jobs would each see a different picture. SharedState is the small
+# interface those go through instead — keys with a TTL, atomic counters,
+# token buckets, leases (one worker at a time runs a job) and an append-only
+# event channel for cache invalidations. Backends, picked by SHARED_STATE:
+#
+#   memory              this process only; the single-worker default
+#   sqlite              tables in the app database; fine for one box
+#   redis://host:6379   any Redis-compatible server (`pip install redis`)
+#
+# Coordinator is a worker's link to the others: broadcast() invalidates a key
+# here right away and in the other workers within `interval` seconds.
+import os
+import json
+import time
+import socket
+import asyncio
+import itertools
+
+import db
+from telemetry import log
+
+EVENT_TTL = 300          # seconds a published event stays readable
+PRUNE_EVERY = 200        # publishes between deletes of old events and expired keys
+READ_BATCH = 1000
+LEASE_INTERVALS = 3      # a lease or worker snapshot outlives this many missed syncs
+
+
+def _gcra(tat, now, rate, burst, cost):
+    """Token bucket as one stored number, the time the bucket will be full again
+    (GCRA). Returns (new time or None if denied, retry after)."""
+    new = max(tat, now) + cost / rate
+    over = new - now - burst / rate
+    return (None, over) if over > 0 else (new, 0.0)
+
+
+class SharedState:
+    """Every method is async. Values are strings; ttl is in seconds, None for no expiry."""
+
+    name = "abstract"
+
+    def init(self, conn):
+        pass
+
+    async def get(self, key):
+        raise NotImplementedError
+
+    async def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    async def delete(self, key):
+        raise NotImplementedError
+
+    async def incr(self, key, amount=1, ttl=None):
+        """Add to an integer counter and return the new value; ttl applies when the counter is created."""
+        raise NotImplementedError
+
+    async def scan(self, prefix):
+        """{key: value} for every live key starting with prefix."""
+        raise NotImplementedError
+
+    async def throttle(self, key, rate, burst, cost=1):
+        """Token bucket refilled at `rate` per second, holding at most `burst`.
+        Takes `cost` tokens and returns (True, 0), or leaves the bucket alone and
+        returns (False, seconds until they would be there)."""
+        raise NotImplementedError
+
+    async def acquire(self, key, owner, ttl):
+        """Take or renew a lease; True while `owner` holds it. An unrenewed lease lapses after ttl."""
+        raise NotImplementedError
+
+    async def release(self, key, owner):
+        raise NotImplementedError
+
+    async def publish(self, channel, message):
+        raise NotImplementedError
+
+    async def tail(self, channel):
+        """Cursor just past the newest event, where a new reader starts."""
+        raise NotImplementedError
+
+    async def read(self, channel, cursor):
+        """(new cursor, [messages]) for events published after cursor."""
+        raise NotImplementedError
+
+    async def aclose(self):
+        pass
+
+
+# --- In-process ---
+class MemoryState(SharedState):
+    name = "memory"
+
+    def __init__(self):
+        self._data = {}      # key -> (value, expires or None)
+        self._events = {}    # channel -> [(id, message, ts)]
+        self._ids = itertools.count(1)
+
+    def _live(self, key):
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.time():
+            del self._data[key]
+            return None
+        return item
+
+    async def get(self, key):
+        item = self._live(key)
+        return item[0] if item else None
+
+    async def set(self, key, value, ttl=None):
+        self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    async def delete(self, key):
+        self._data.pop(key, None)
+
+    async def incr(self, key, amount=1, ttl=None):
+        item = self._live(key)
+        value = int(item[0]) + amount if item else amount
+        self._data[key] = (str(value), item[1] if item else (time.time() + ttl if ttl else None))
+        return value
+
+    async def scan(self, prefix):
+        return {k: item[0] for k in list(self._data) if k.startswith(prefix) and (item := self._live(k))}
+
+    async def throttle(self, key, rate, burst, cost=1):
+        item = self._live(key)
+        now = time.time()
+        new, retry = _gcra(float(item[0]) if item else 0.0, now, rate, burst, cost)
+        if new is None:
+            return False, retry
+        self._data[key] = (repr(new), new)
+        return True, 0.0
+
+    async def acquire(self, key, owner, ttl):
+        item = self._live(key)
+        if item is None or item[0] == owner:
+            self._data[key] = (owner, time.time() + ttl)
+            return True
+        return False
+
+    async def release(self, key, owner):
+        item = self._live(key)
+        if item and item[0] == owner:
+            del self._data[key]
+
+    async def publish(self, channel, message):
+        events = self._events.setdefault(channel, [])
+        events.append((next(self._ids), message, time.time()))
+        cutoff = time.time() - EVENT_TTL
+        while events and events[0][2] < cutoff:
+            events.pop(0)
+
+    async def tail(self, channel):
+        events = self._events.get(channel)
+        return events[-1][0] if events else 0
+
+    async def read(self, channel, cursor):
+        found = [(i, m) for i, m, _ in self._events.get(channel, ()) if i > cursor][:READ_BATCH]
+        return (found[-1][0] if found else cursor), [m for _, m in found]
+
+
+# --- SQLite ---
+class SQLiteState(SharedState):
+    """Two tables in the app database. WAL lets every worker read while one writes."""
+
+    name = "sqlite"
+
+    def __init__(self, pool=db.pool):
+        self.pool = pool
+        self._publishes = 0
+
+    def init(self, conn):
+        conn.execute("CREATE TABLE IF NOT EXISTS shared_kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS shared_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel TEXT NOT NULL,
+            message TEXT NOT NULL,
+            ts REAL NOT NULL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_shared_events_channel ON shared_events (channel, id)")
+
+    async def get(self, key):
+        row = await self.pool.fetchone("SELECT value FROM shared_kv WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                                       (key, time.time()))
+        return row["value"] if row else None
+
+    async def set(self, key, value, ttl=None):
+        await self.pool.execute("INSERT OR REPLACE INTO shared_kv (key, value, expires) VALUES (?, ?, ?)",
+                                (key, value, time.time() + ttl if ttl else None))
+
+    async def delete(self, key):
+        await self.pool.execute("DELETE FROM shared_kv WHERE key = ?", (key,))
+
+    async def incr(self, key, amount=1, ttl=None):
+        now = time.time()
+        # an expired counter starts over, with a fresh ttl
+        row = await self.pool.fetchone("""
+            INSERT INTO shared_kv (key, value, expires) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                value = CASE WHEN expires <= ? THEN excluded.value ELSE CAST(value AS INTEGER) + ? END,
+                expires = CASE WHEN expires <= ? THEN excluded.expires ELSE expires END
+            RETURNING value
+        """, (key, amount, now + ttl if ttl else None, now, amount, now))
+        return int(row["value"])
+
+    async def scan(self, prefix):
+        rows = await self.pool.fetchall("SELECT key, value FROM shared_kv WHERE substr(key, 1, ?) = ? AND (expires IS NULL OR expires > ?)",
+                                        (len(prefix), prefix, time.time()))
+        return {r["key"]: r["value"] for r in rows}
+
+    async def throttle(self, key, rate, burst, cost=1):
+        def job(conn):
+            conn.execute("BEGIN IMMEDIATE")  # read-modify-write: two workers must not both spend the last token
+            now = time.time()
+            row = conn.execute("SELECT value FROM shared_kv WHERE key = ?", (key,)).fetchone()
+            new, retry = _gcra(float(row["value"]) if row else 0.0, now, rate, burst, cost)
+            if new is not None:
+                conn.execute("INSERT OR REPLACE INTO shared_kv (key, value, expires) VALUES (?, ?, ?)", (key, repr(new), new))
+            return new is not None, retry
+        return await self.pool.run(job)
+
+    async def acquire(self, key, owner, ttl):
+        now = time.time()
+        row = await self.pool.fetchone("""
+            INSERT INTO shared_kv (key, value, expires) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires
+                WHERE shared_kv.value = excluded.value OR shared_kv.expires <= ?
+            RETURNING value
+        """, (key, owner, now + ttl, now))
+        return row is not None
+
+    async def release(self, key, owner):
+        await self.pool.execute("DELETE FROM shared_kv WHERE key = ? AND value = ?", (key, owner))
+
+    async def publish(self, channel, message):
+        await self.pool.execute("INSERT INTO shared_events (channel, message, ts) VALUES (?, ?, ?)",
+                                (channel, message, time.time()))
+        self._publishes += 1
+        if self._publishes % PRUNE_EVERY == 0:
+            await self.prune()
+
+    async def prune(self):
+        def job(conn):
+            now = time.time()
+            conn.execute("DELETE FROM shared_events WHERE ts < ?", (now - EVENT_TTL,))
+            conn.execute("DELETE FROM shared_kv WHERE expires <= ?", (now,))
+        await self.pool.run(job)
+
+    async def tail(self, channel):
+        row = await self.pool.fetchone("SELECT COALESCE(MAX(id), 0) AS id FROM shared_events WHERE channel = ?", (channel,))
+        return row["id"]
+
+    async def read(self, channel, cursor):
+        rows = await self.pool.fetchall("SELECT id, message FROM shared_events WHERE channel = ? AND id > ? ORDER BY id LIMIT ?",
+                                        (channel, cursor, READ_BATCH))
+        return (rows[-1]["id"] if rows else cursor), [r["message"] for r in rows]
+
+
+# --- Redis ---
+class RedisState(SharedState):
+    """Redis or anything speaking its protocol. Event channels are streams, so
+    a worker that was busy for a moment still reads what it missed.
+    `client` is any redis.asyncio-compatible client (tests pass a fake)."""
+
+    name = "redis"
+
+    def __init__(self, url=None, client=None, prefix="thetamind:"):
+        if client is None:
+            import redis.asyncio
+            client = redis.asyncio.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+
+    def _k(self, key):
+        return self.prefix + key
+
+    async def get(self, key):
+        return await self.client.get(self._k(key))
+
+    async def set(self, key, value, ttl=None):
+        await self.client.set(self._k(key), value, px=int(ttl * 1000) if ttl else None)
+
+    async def delete(self, key):
+        await self.client.delete(self._k(key))
+
+    async def incr(self, key, amount=1, ttl=None):
+        value = await self.client.incrby(self._k(key), amount)
+        if ttl and value == amount:
+            await self.client.pexpire(self._k(key), int(ttl * 1000))  # we created it
+        return value
+
+    async def scan(self, prefix):
+        keys = [k async for k in self.client.scan_iter(match=self._k(prefix) + "*")]
+        values = await self.client.mget(keys) if keys else []
+        return {k[len(self.prefix):]: v for k, v in zip(keys, values) if v is not None}
+
+    async def throttle(self, key, rate, burst, cost=1):
+        from redis.exceptions import WatchError
+        key = self._k(key)
+        async with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)  # retried if another worker spends tokens in between
+                    tat = await pipe.get(key)
+                    now = time.time()
+                    new, retry = _gcra(float(tat) if tat else 0.0, now, rate, burst, cost)
+                    if new is None:
+                        await pipe.unwatch()
+                        return False, retry
+                    pipe.multi()
+                    pipe.set(key, repr(new), px=max(1, int((new - now) * 1000)))
+                    await pipe.execute()
+                    return True, 0.0
+                except WatchError:
+                    continue
+
+    async def acquire(self, key, owner, ttl):
+        px = int(ttl * 1000)
+        if await self.client.set(self._k(key), owner, px=px, nx=True):
+            return True
+        if await self.client.get(self._k(key)) == owner:
+            await self.client.pexpire(self._k(key), px)
+            return True
+        return False
+
+    async def release(self, key, owner):
+        if await self.client.get(self._k(key)) == owner:
+            await self.client.delete(self._k(key))
+
+    async def publish(self, channel, message):
+        await self.client.xadd(self._k(f"events:{channel}"), {"m": message}, maxlen=10000, approximate=True)
+
+    async def tail(self, channel):
+        last = await self.client.xrevrange(self._k(f"events:{channel}"), count=1)
+        return last[0][0] if last else "0-0"
+
+    async def read(self, channel, cursor):
+        found = await self.client.xrange(self._k(f"events:{channel}"), min=f"({cursor}", count=READ_BATCH)
+        return (found[-1][0] if found else cursor), [fields["m"] for _, fields in found]
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def from_url(url, pool=db.pool):
+    if url in ("", "memory"):
+        return MemoryState()
+    if url == "sqlite":
+        return SQLiteState(pool)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisState(url)
+    raise ValueError(f"SHARED_STATE must be memory, sqlite or a redis:// URL, not {url!r}")
+
+
+# --- Coordination ---
+class Coordinator:
+    """Polls the event channels this worker handles, renews its leases and
+    publishes snapshot() (stats other workers read with peers()) every interval."""
+
+    def __init__(self, state, worker_id=None, interval=1.0):
+        self.state = state
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.interval = interval
+        self.snapshot = None      # fn() -> JSON-able dict
+        self._handlers = {}       # channel -> fn(message)
+        self._cursors = {}
+        self._leases = {}         # name -> currently held
+        self._task = None
+        self.sent = 0
+        self.received = 0
+        self.errors = 0
+
+    def on(self, channel, fn):
+        self._handlers[channel] = fn
+
+    def lease(self, name):
+        """Compete for `name` on every sync; holds(name) says whether this worker has it."""
+        self._leases.setdefault(name, False)
+
+    def holds(self, name):
+        return self._leases.get(name, False)
+
+    async def broadcast(self, channel, message):
+        """Run the channel's handler here now and in every other worker on its next sync.
+        If the shared state is down, the others aren't told and their copies
+        live out their TTL; the caller's request still succeeds."""
+        self._handlers[channel](message)
+        try:
+            await self.state.publish(channel, json.dumps([self.worker_id, message]))
+        except Exception:
+            self.errors += 1
+            log.exception("shared state publish failed", extra={"fields": {"channel": channel}})
+            return
+        self.sent += 1
+
+    async def sync(self):
+        for channel, fn in self._handlers.items():
+            self._cursors[channel], messages = await self.state.read(channel, self._cursors[channel])
+            for raw in messages:
+                origin, message = json.loads(raw)
+                if origin != self.worker_id:
+                    fn(message)
+                    self.received += 1
+        ttl = self.interval * LEASE_INTERVALS
+        for name in self._leases:
+            self._leases[name] = await self.state.acquire(f"lease:{name}", self.worker_id, ttl)
+        if self.snapshot is not None:
+            await self.state.set(f"worker:{self.worker_id}", json.dumps(self.snapshot()), ttl=ttl)
+
+    async def peers(self):
+        """{worker id: snapshot} for the other live workers."""
+        found = await self.state.scan("worker:")
+        own = f"worker:{self.worker_id}"
+        return {key[len("worker:"):]: json.loads(value) for key, value in found.items() if key != own}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sync()
+            except Exception:
+                self.errors += 1
+                log.exception("shared state sync failed")
+
+    async def start(self):
+        for channel in self._handlers:
+            self._cursors[channel] = await self.state.tail(channel)
+        await self.sync()  # settle leases before serving
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for name, held in self._leases.items():
+            if held:
+                await self.state.release(f"lease:{name}", self.worker_id)  # hand over without waiting out the ttl
+        await self.state.delete(f"worker:{self.worker_id}")
+        await self.state.aclose()
+
+    def stats(self):
+        return {"backend": self.state.name, "worker": self.worker_id, "leases": dict(self._leases),
+                "sent": self.sent, "received": self.received, "errors": self.errors}
@@ -0,0 +1,38 @@
+# singleflight.py  (coalesce identical in-flight calls)
+import asyncio
+
+
+class SingleFlight:
+    """Concurrent callers with the same key share one underlying call.
+
+    The call runs as its own task and every caller awaits it through
+    asyncio.shield, so one caller being cancelled (client disconnect) does not
+    cancel the upstream request the others are waiting on.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def __contains__(self, key):
+        return key in self._inflight
+
+    def _done(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every waiter went away
+
+    async def do(self, key, call):
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(call())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.followers += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"in_flight": len(self._inflight), "leaders": self.leaders, "followers": self.followers}
@@ -36,6 +36,43 @@ document.addEventListener('DOMContentLoaded', () => {
         openModal();
     }
 
+    // Error replies carry {"error": ...}; a 429 also says when to try again
+    async function httpError(response) {
+        let message = `HTTP error! status: ${response.status}`;
+        try { message = (await response.json()).error || message; } catch (e) {}
+        const retry = response.headers.get('Retry-After');
+        return new Error(retry ? `${message} (retry in ${retry}s)` : message);
+    }
+
+    // --- Streaming ---
+    // POSTs with stream=1 and reads the NDJSON reply line by line: each
+    // {"field", "value"} line is handed to onField as soon as it arrives, and
+    // the final {"done", "result"} object is returned.
+    async function fetchStream(url, formData, onField) {
+        formData.append('stream', '1');
+        const response = await fetch(url, { method: 'POST', body: formData });
+        if (!response.ok) throw await httpError(response);
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+            let newline;
+            while ((newline = buffer.indexOf('\n')) >= 0) {
+                const line = buffer.slice(0, newline).trim();
+                buffer = buffer.slice(newline + 1);
+                if (!line) continue;
+                const msg = JSON.parse(line);
+                if (msg.error) throw new Error(msg.error);
+                if (msg.done) return msg.result;
+                onField(msg.field, msg.value);
+            }
+            if (done) throw new Error('Stream ended early');
+        }
+    }
+
     // --- Learn Button Logic ---
     learnBtns.forEach(btn => {
         btn.addEventListener('click', async () => {
@@ -50,17 +87,14 @@ document.addEventListener('DOMContentLoaded', () => {
             formData.append('topic', topic);
 
             try {
-                const response = await fetch('/api/get_lesson', { method: 'POST', body: formData });
-                if (!response.ok) throw new Error('Network error');
-                const data = await response.json();
-                
-                if(data.error) {
-                     lessonArea.innerHTML = `<p style="color: var(--error-color);">${data.error}</p>`;
-                } else {
-                     lessonArea.innerHTML = `<p>${data.explanation.replace(/\n/g, '<br>')}</p>`;
-                }
+                await fetchStream('/api/get_lesson', formData, (field, value) => {
+                    if (field === 'explanation') {
+                        lessonArea.innerHTML = `<p>${value.replace(/\n/g, '<br>')}</p>`;
+                        showInModal('lesson');
+                    }
+                });
             } catch (e) {
-                 lessonArea.innerHTML = `<p style="color: var(--error-color);">Failed to load lesson.</p>`;
+                 lessonArea.innerHTML = `<p style="color: var(--error-color);">Failed to load lesson: ${e.message}</p>`;
             } finally {
                 showInModal('lesson');
             }
@@ -98,7 +132,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         try {
             const response = await fetch('/api/generate_quiz', { method: 'POST', body: formData });
-            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+            if (!response.ok) throw await httpError(response);
             currentQuizData = await response.json();
             if (currentQuizData.error) throw new Error(currentQuizData.error);
             questionText.textContent = currentQuizData.question;
@@ -125,10 +159,13 @@ document.addEventListener('DOMContentLoaded', () => {
         formData.append('difficulty', document.getElementById('difficulty-select').value);
 
         try {
-            const response = await fetch('/api/evaluate_answer', { method: 'POST', body: formData });
-            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-            const evaluation = await response.json();
-            if (evaluation.error) throw new Error(evaluation.error);
+            // Render each part of the evaluation as soon as it has streamed in
+            const partial = {};
+            const evaluation = await fetchStream('/api/evaluate_answer', formData, (field, value) => {
+                partial[field] = value;
+                loader.style.display = 'none';
+                displayFeedback(partial);
+            });
             displayFeedback(evaluation);
         } catch (error) {
             displayFeedback({ error: `Could not get evaluation: ${error.message}` });
@@ -141,8 +178,10 @@ document.addEventListener('DOMContentLoaded', () => {
         if (evaluation.error) {
             feedbackArea.innerHTML = `<h3 class="feedback-incorrect">Error</h3><p>${evaluation.error}</p>`;
         } else {
-            const resultTitle = evaluation.is_correct ? '<h3 class="feedback-correct"><i class="fas fa-check-circle"></i> Correct!</h3>' : '<h3 class="feedback-incorrect"><i class="fas fa-times-circle"></i> Needs Review</h3>';
-            feedbackArea.innerHTML = `${resultTitle}<p><strong>Feedback:</strong> ${evaluation.feedback}</p><hr><p><strong>Alternative Method:</strong> ${evaluation.smarter_way}</p>`;
+            const resultTitle = evaluation.is_correct === undefined ? '' : evaluation.is_correct ? '<h3 class="feedback-correct"><i class="fas fa-check-circle"></i> Correct!</h3>' : '<h3 class="feedback-incorrect"><i class="fas fa-times-circle"></i> Needs Review</h3>';
+            const feedback = evaluation.feedback !== undefined ? `<p><strong>Feedback:</strong> ${evaluation.feedback}</p>` : '';
+            const smarterWay = evaluation.smarter_way !== undefined ? `<hr><p><strong>Alternative Method:</strong> ${evaluation.smarter_way}</p>` : '';
+            feedbackArea.innerHTML = `${resultTitle}${feedback}${smarterWay}`;
         }
         feedbackArea.style.display = 'block';
     }
@@ -1,32 +1,35 @@
-document.addEventListener('DOMContentLoaded', () => {
-    const statsDataEl = document.getElementById('stats-data');
-    if (!statsDataEl) return;
+// Chart data comes from the /api/history endpoints. They send an ETag, so a
+// revisit with no new answers is a 304 served from the browser cache.
+async function fetchJSON(url) {
+    const response = await fetch(url, { credentials: 'same-origin' });
+    if (!response.ok) throw new Error(`${url}: HTTP ${response.status}`);
+    return response.json();
+}
 
-    const stats = JSON.parse(statsDataEl.innerHTML);
-    if (!stats || stats.length === 0) return;
+document.addEventListener('DOMContentLoaded', async () => {
+    if (!document.getElementById('dashboard')) return;
 
-    // --- Process data for charts ---
-    const topicData = {};
-    let totalCorrect = 0;
-    let totalIncorrect = 0;
+    loadHistory();
 
-    stats.forEach(stat => {
-        if (!topicData[stat.topic]) {
-            topicData[stat.topic] = { correct: 0, incorrect: 0 };
-        }
-        if (stat.is_correct) {
-            topicData[stat.topic].correct += stat.count;
-            totalCorrect += stat.count;
-        } else {
-            topicData[stat.topic].incorrect += stat.count;
-            totalIncorrect += stat.count;
-        }
-    });
+    let topics, trend;
+    try {
+        [topics, trend] = await Promise.all([
+            fetchJSON('/api/history/topics'),
+            fetchJSON('/api/history/accuracy?bucket=day&limit=30'),
+        ]);
+    } catch (err) {
+        console.error('Failed to load dashboard data:', err);
+        return;
+    }
+    if (!topics || topics.length === 0) return;
+
+    // --- Process data for charts ---
+    const topicLabels = topics.map(t => t.topic);
+    const correctData = topics.map(t => t.correct);
+    const incorrectData = topics.map(t => t.attempts - t.correct);
+    const totalCorrect = correctData.reduce((a, b) => a + b, 0);
+    const totalIncorrect = incorrectData.reduce((a, b) => a + b, 0);
 
-    const topicLabels = Object.keys(topicData);
-    const correctData = topicLabels.map(topic => topicData[topic].correct);
-    const incorrectData = topicLabels.map(topic => topicData[topic].incorrect);
-    
     const isDarkMode = !document.body.classList.contains('light-mode');
     const gridColor = isDarkMode ? 'rgba(255, 255, 255, 0.1)' : 'rgba(0, 0, 0, 0.1)';
     const textColor = isDarkMode ? '#e0e0e0' : '#333';
@@ -107,4 +110,65 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         });
     }
+
+    // --- Chart 3: Accuracy Over Time (Line) ---
+    const trendCtx = document.getElementById('accuracyTrendChart')?.getContext('2d');
+    if (trendCtx && trend.length) {
+        new Chart(trendCtx, {
+            type: 'line',
+            data: {
+                labels: trend.map(b => b.bucket),
+                datasets: [{
+                    label: 'Accuracy (%)',
+                    data: trend.map(b => Math.round(b.accuracy * 100)),
+                    borderColor: 'rgba(0, 247, 255, 1)',
+                    backgroundColor: 'rgba(0, 247, 255, 0.2)',
+                    fill: true,
+                    tension: 0.3
+                }]
+            },
+            options: {
+                responsive: true,
+                plugins: {
+                    legend: { labels: { color: textColor } },
+                    title: { display: false }
+                },
+                scales: {
+                    x: { grid: { color: gridColor }, ticks: { color: textColor } },
+                    y: { min: 0, max: 100, grid: { color: gridColor }, ticks: { color: textColor } }
+                }
+            }
+        });
+    }
 });
+
+// --- Recent attempts, one keyset page at a time ---
+async function loadHistory(cursor) {
+    const list = document.getElementById('history-list');
+    const more = document.getElementById('history-more');
+    if (!list || !more) return;
+
+    const params = new URLSearchParams({ limit: 20 });
+    if (cursor) params.set('cursor', cursor);
+    let page;
+    try {
+        page = await fetchJSON(`/api/history?${params}`);
+    } catch (err) {
+        console.error('Failed to load history:', err);
+        return;
+    }
+
+    page.items.forEach(item => {
+        const li = document.createElement('li');
+        const question = document.createElement('span');
+        question.textContent = `${item.topic} (${item.difficulty}): ${item.question}`;
+        const result = document.createElement('span');
+        result.className = item.is_correct ? 'correct' : 'incorrect';
+        result.innerHTML = item.is_correct ? '<i class="fas fa-check"></i>' : '<i class="fas fa-times"></i>';
+        li.append(question, result);
+        list.appendChild(li);
+    });
+
+    more.style.display = page.next_cursor ? 'inline-block' : 'none';
+    more.onclick = () => loadHistory(page.next_cursor);
+}
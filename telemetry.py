@@ -0,0 +1,255 @@
+# telemetry.py  (request timing, spans, structured logs, Prometheus metrics)
+#
+# TimingMiddleware times every HTTP request and gives it a span table in a
+# context variable; `with span("db"):` around a hot call adds its duration to
+# that table and to a per-span histogram. On the way out the table becomes a
+# Server-Timing header and one JSON log line, and /metrics renders all of it
+# in the Prometheus text format, merged with the snapshot() every other
+# worker publishes. With TELEMETRY=0 the middleware is not installed and
+# span() hands back a shared no-op, so the cost is one global lookup per call
+# site.
+import os
+import json
+import time
+import logging
+import contextvars
+from bisect import bisect_left
+
+ENABLED = os.getenv("TELEMETRY", "1") == "1"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+log = logging.getLogger("thetamind")
+_spans = contextvars.ContextVar("spans", default=None)
+
+
+# --- Logging ---
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; fields passed as extra={"fields": {...}} are merged in."""
+
+    def format(self, record):
+        out = {"ts": round(record.created, 3), "level": record.levelname.lower(), "logger": record.name,
+               "msg": record.getMessage()}
+        out.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, default=str)
+
+
+def configure_logging():
+    if log.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json"
+                         else logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    log.addHandler(handler)
+    log.setLevel(LOG_LEVEL)
+    log.propagate = False
+
+
+# --- Metrics ---
+def _labels(labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}   # label tuple -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def snapshot(self):
+        return [[list(map(list, key)), series] for key, series in self._series.items()]
+
+    def render(self, peers=()):
+        merged = {key: list(series) for key, series in self._series.items()}
+        for snapshot in peers:
+            for key, series in snapshot:
+                key = tuple(map(tuple, key))
+                mine = merged.get(key)
+                merged[key] = series if mine is None else [a + b for a, b in zip(mine, series)]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(merged.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), series):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(key)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Read at scrape time from fn(), which returns a number or {label value: number}."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, label=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.label = label
+
+    def snapshot(self):
+        return self.fn()
+
+    def render(self, peers=()):
+        """Values from other workers are summed in (queue depths, calls in flight)."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        totals = {}
+        for value in (self.fn(), *peers):
+            for label, v in (value.items() if isinstance(value, dict) else [(None, value)]):
+                totals[label] = totals.get(label, 0) + v
+        for label, v in totals.items():
+            lines.append(f"{self.name}{_labels(((self.label, label),) if label is not None else ())} {v}")
+        return lines
+
+
+class Counter(Gauge):
+    """A Gauge whose fn() only ever goes up (totals kept by the code being measured)."""
+
+    kind = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.in_flight = 0
+        self.requests = Histogram("thetamind_http_request_duration_seconds", "HTTP request latency by route.")
+        self.spans = Histogram("thetamind_span_duration_seconds", "Time spent in instrumented hot paths.")
+        self.add(self.requests)
+        self.add(self.spans)
+        self.add(Gauge("thetamind_http_requests_in_flight", "HTTP requests currently being served.",
+                       lambda: self.in_flight))
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, fn, label=None):
+        return self.add(Gauge(name, help, fn, label))
+
+    def counter(self, name, help, fn, label=None):
+        return self.add(Counter(name, help, fn, label))
+
+    def snapshot(self):
+        return {m.name: m.snapshot() for m in self.metrics}
+
+    def render(self, peers=()):
+        """peers: snapshot() of every other worker, merged into this one's series."""
+        return "\n".join(line for m in self.metrics
+                         for line in m.render([p[m.name] for p in peers if m.name in p])) + "\n"
+
+
+registry = Registry()
+
+
+# --- Spans ---
+class _Span:
+    __slots__ = ("name", "table", "start")
+
+    def __init__(self, name, table):
+        self.name = name
+        self.table = table
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        entry = self.table.get(self.name)
+        if entry is None:
+            self.table[self.name] = [elapsed, 1]
+        else:
+            entry[0] += elapsed
+            entry[1] += 1
+        registry.spans.observe(elapsed, span=self.name)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NOOP = _NoSpan()
+
+
+def span(name):
+    """Time a block against the current request: `with span("ai"): ...`. Nests and repeats fine."""
+    if not ENABLED:
+        return _NOOP
+    table = _spans.get()
+    return _NOOP if table is None else _Span(name, table)
+
+
+def server_timing(table, total=None):
+    parts = [f'{name};dur={s * 1000:.1f};desc="x{n}"' if n > 1 else f"{name};dur={s * 1000:.1f}"
+             for name, (s, n) in table.items()]
+    if total is not None:
+        parts.append(f"app;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# --- Middleware ---
+MOUNTS = ("/static/", "/assets/")
+
+
+def _mount(path):
+    """Route label for requests that didn't hit an API route, without per-file cardinality."""
+    for prefix in MOUNTS:
+        if path.startswith(prefix):
+            return prefix.rstrip("/")
+    return "unmatched"
+
+
+class TimingMiddleware:
+    """Plain ASGI middleware, so streaming responses pass through untouched."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        table = {}
+        token = _spans.set(table)
+        start = time.perf_counter()
+        status = 500
+        registry.in_flight += 1
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing(table, time.perf_counter() - start).encode("latin-1")
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            elapsed = time.perf_counter() - start
+            registry.in_flight -= 1
+            _spans.reset(token)
+            # route_label: set by middleware that answered before routing (admission 429s)
+            route = getattr(scope.get("route"), "path", None) or scope.get("route_label") or _mount(scope["path"])
+            registry.requests.observe(elapsed, method=scope["method"], route=route, status=status)
+            log.info("request", extra={"fields": {
+                "method": scope["method"], "path": scope["path"], "route": route, "status": status,
+                "ms": round(elapsed * 1000, 2),
+                "spans": {name: round(s * 1000, 2) for name, (s, _) in table.items()},
+            }})
@@ -13,11 +13,14 @@ from passlib.context import CryptContext
 from typing import Optional
 from starlette.requests import Request
 from starlette.responses import Response
+from contextlib import asynccontextmanager
+
+import db
 
 load_dotenv()
 
 # --- Configuration ---
-DB = "thetamind.db"
+DB = db.DB
 AI_P = os.getenv("AI_PROVIDER", "openai")
 OPENAI_KEY = os.getenv("OPENAI_API_KEY", "")
 GEMINI_KEY = os.getenv("GEMINI_API_KEY", "")
@@ -30,54 +33,51 @@ if IS_AI_CONFIGURED:
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-app = FastAPI(title="thetamind")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    db.pool.close()
+
+app = FastAPI(title="thetamind", lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 # --- Database Initialization ---
 def db_init():
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        email TEXT UNIQUE NOT NULL,
-        hashed_password TEXT NOT NULL
-    )
-    """)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS quiz_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        topic TEXT NOT NULL,
-        difficulty TEXT NOT NULL,
-        question TEXT NOT NULL,
-        user_solution TEXT,
-        is_correct BOOLEAN,
-        ts DATETIME DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    """)
-    conn.commit()
-    conn.close()
+    with db.pool.connection() as conn, conn:
+        cur = conn.cursor()
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            hashed_password TEXT NOT NULL
+        )
+        """)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS quiz_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            topic TEXT NOT NULL,
+            difficulty TEXT NOT NULL,
+            question TEXT NOT NULL,
+            user_solution TEXT,
+            is_correct BOOLEAN,
+            ts DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        """)
 
 db_init()
 
 # --- User and Session Management ---
-def get_user(username: str):
-    conn = sqlite3.connect(DB)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE username = ?", (username,))
-    user = cur.fetchone()
-    conn.close()
-    return user
-
-def get_current_user(request: Request):
+async def get_user(username: str):
+    return await db.pool.fetchone("SELECT * FROM users WHERE username = ?", (username,))
+
+async def get_current_user(request: Request):
     username = request.cookies.get("thetamind_user")
     if username:
-        return get_user(username)
+        return await get_user(username)
     return None
 
 def verify_password(plain_password, hashed_password):
@@ -112,7 +112,7 @@ async def ai_q(prompt: str) -> str:
 # --- Page Routes ---
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     return templates.TemplateResponse("index.html", {"request": request, "user": user})
 
 @app.post("/register")
@@ -122,20 +122,15 @@ async def register_user(request: Request, username: str = Form(...), email: str
     print(f"Length (bytes): {len(password.encode('utf-8'))}")
 
     hashed_password = get_password_hash(password)
-    conn = sqlite3.connect(DB)
-    cur = conn.cursor()
     try:
-        cur.execute("INSERT INTO users (username, email, hashed_password) VALUES (?, ?, ?)", (username, email, hashed_password))
-        conn.commit()
+        await db.pool.execute("INSERT INTO users (username, email, hashed_password) VALUES (?, ?, ?)", (username, email, hashed_password))
     except sqlite3.IntegrityError:
         return templates.TemplateResponse("register.html", {"request": request, "error": "Username or email already exists."})
-    finally:
-        conn.close()
     return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
 
 @app.post("/login")
 async def login_user(request: Request, username: str = Form(...), password: str = Form(...)):
-    user = get_user(username)
+    user = await get_user(username)
     if not user or not verify_password(password, user["hashed_password"]):
         return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid username or password"})
     response = RedirectResponse(url="/dashboard", status_code=status.HTTP_303_SEE_OTHER)
@@ -156,46 +151,41 @@ async def login_page(request: Request): return templates.TemplateResponse("login
 
 @app.get("/tools", response_class=HTMLResponse)
 async def tools_page(request: Request):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     return templates.TemplateResponse("tools.html", {"request": request, "user": user})
 
 @app.get("/algebra", response_class=HTMLResponse)
 async def algebra_page(request: Request):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user: return RedirectResponse(url="/login")
     return templates.TemplateResponse("algebra.html", {"request": request, "user": user})
 
 @app.get("/geometry", response_class=HTMLResponse)
 async def geometry_page(request: Request):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     return templates.TemplateResponse("coming_soon.html", {"request": request, "user": user, "topic": "Geometry"})
 
 @app.get("/calculus", response_class=HTMLResponse)
 async def calculus_page(request: Request):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     return templates.TemplateResponse("coming_soon.html", {"request": request, "user": user, "topic": "Calculus"})
 
 @app.get("/dashboard", response_class=HTMLResponse)
 async def dashboard(request: Request):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user: return RedirectResponse(url="/login")
-    conn = sqlite3.connect(DB)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT topic, difficulty, is_correct, COUNT(*) as count FROM quiz_history WHERE user_id = ? GROUP BY topic, difficulty, is_correct", (user["id"],))
-    stats = cur.fetchall()
-    conn.close()
+    stats = await db.pool.fetchall("SELECT topic, difficulty, is_correct, COUNT(*) as count FROM quiz_history WHERE user_id = ? GROUP BY topic, difficulty, is_correct", (user["id"],))
     return templates.TemplateResponse("dashboard.html", {"request": request, "user": user, "stats": stats})
 
 @app.get("/about", response_class=HTMLResponse)
 async def about_page(request: Request):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     return templates.TemplateResponse("about.html", {"request": request, "user": user})
 
 # --- API Routes ---
 @app.post("/api/generate_quiz")
 async def generate_quiz(request: Request, topic: str = Form(...), difficulty: str = Form(...)):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user: return JSONResponse(content={"error": "Authentication required"}, status_code=401)
     prompt = f"Generate a single math quiz question on the topic of '{topic}' with a difficulty of '{difficulty}'. Format the response as a JSON object with keys: 'question', 'solution', 'difficulty'."
     ai_response = await ai_q(prompt)
@@ -204,7 +194,7 @@ async def generate_quiz(request: Request, topic: str = Form(...), difficulty: st
 
 @app.post("/api/evaluate_answer")
 async def evaluate_answer(request: Request, question: str = Form(...), user_solution: str = Form(...), correct_solution: str = Form(...), topic: str = Form(...), difficulty: str = Form(...)):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user: return JSONResponse(content={"error": "Authentication required"}, status_code=401)
     prompt = f"""As an expert AI Math Tutor, evaluate a student's work.
     Original Question: "{question}"
@@ -214,17 +204,13 @@ async def evaluate_answer(request: Request, question: str = Form(...), user_solu
     ai_response = await ai_q(prompt)
     try:
         evaluation = json.loads(ai_response)
-        conn = sqlite3.connect(DB)
-        cur = conn.cursor()
-        cur.execute("INSERT INTO quiz_history (user_id, topic, difficulty, question, user_solution, is_correct) VALUES (?, ?, ?, ?, ?, ?)", (user["id"], topic, difficulty, question, user_solution, evaluation.get("is_correct", False)))
-        conn.commit()
-        conn.close()
+        await db.pool.execute("INSERT INTO quiz_history (user_id, topic, difficulty, question, user_solution, is_correct) VALUES (?, ?, ?, ?, ?, ?)", (user["id"], topic, difficulty, question, user_solution, evaluation.get("is_correct", False)))
         return JSONResponse(content=evaluation)
     except (json.JSONDecodeError, TypeError): return JSONResponse(content={"error": "Failed to get a valid evaluation from AI."}, status_code=500)
 
 @app.post("/api/get_lesson")
 async def get_lesson(request: Request, topic: str = Form(...)):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user: return JSONResponse(content={"error": "Authentication required"}, status_code=401)
     prompt = f"Explain the following math concept in a clear, concise way suitable for a student: '{topic}'. Format the response as a JSON object with keys: 'title' and 'explanation'."
     ai_response = await ai_q(prompt)
@@ -233,7 +219,7 @@ async def get_lesson(request: Request, topic: str = Form(...)):
 
 @app.post("/api/solve_problem")
 async def solve_problem(request: Request, problem: str = Form(...)):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user: return JSONResponse(content={"error": "Authentication required"}, status_code=401)
     prompt = f"Solve the following math problem and provide a step-by-step explanation: '{problem}'. Format the response as a JSON object with a single key: 'solution'."
     ai_response = await ai_q(prompt)
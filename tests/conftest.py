@@ -0,0 +1,30 @@
+# Tests run against a throwaway database and the mock AI provider; this has
+# to happen before main or db is first imported.
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ["THETAMIND_DB"] = os.path.join(tempfile.mkdtemp(prefix="thetamind-test-"), "test.db")
+os.environ["OPENAI_API_KEY"] = os.environ["GEMINI_API_KEY"] = ""
+os.environ.setdefault("QUIZ_POOL", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import pytest
+
+import db
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def pool(tmp_path):
+    """A connection pool on a fresh database file."""
+    p = db.Pool(str(tmp_path / "thetamind.db"), size=2)
+    yield p
+    p.close()
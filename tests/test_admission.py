@@ -0,0 +1,46 @@
+import asyncio
+
+import httpx
+import pytest
+from starlette.responses import JSONResponse
+
+from admission import Admission, AdmissionMiddleware, PriorityGate
+from sharedstate import MemoryState
+
+pytestmark = pytest.mark.anyio
+
+ROUTES = {"/api/evaluate_answer": ("evaluate", 0), "/api/get_lesson": ("lesson", 3)}
+
+
+async def ok(scope, receive, send):
+    await JSONResponse({"ok": True})(scope, receive, send)
+
+
+def client(admission):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=AdmissionMiddleware(ok, admission)),
+                             base_url="http://test", cookies={"thetamind_user": "alice"})
+
+
+async def test_a_request_the_gate_turns_away_spends_no_tokens():
+    async def resolve(username):
+        return {"id": 1, "username": username} if username == "alice" else None
+    gate = PriorityGate(limit=1, max_queue=1)
+    admission = Admission(MemoryState(), gate, ROUTES, user_rate=0.01, user_burst=1, resolve=resolve)
+    await gate.acquire(0)                                 # the only slot is busy
+    waiter = asyncio.create_task(gate.acquire(0))         # and the queue is full
+    await asyncio.sleep(0)
+
+    async with client(admission) as c:
+        response = await c.post("/api/get_lesson")
+        assert response.status_code == 429
+        assert response.json()["reason"] == "queue_full"
+
+        gate.release()
+        await waiter
+        gate.release()
+        response = await c.post("/api/get_lesson")       # the one token is still there
+        assert response.status_code == 200
+        response = await c.post("/api/get_lesson")
+        assert response.json()["reason"] == "user_rate"
+    assert gate.active == 0                               # the rate-limited request gave its slot back
+    assert admission.rejected["queue_full"] == admission.rejected["user_rate"] == 1
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+QUIZ = "Generate a single math quiz question on the topic of 'Algebra' with a difficulty of 'easy'."
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Replaces the provider call behind ai_q with one that counts its calls."""
+    calls = []
+
+    async def counting_ai_call(prompt):
+        calls.append(prompt)
+        await asyncio.sleep(0.05)
+        return '{"question": "q", "solution": "s", "difficulty": "easy"}'
+    monkeypatch.setattr(main, "_ai_call", counting_ai_call)
+    return calls
+
+
+async def test_quiz_is_not_cached(upstream):
+    first = await main.ai_q(QUIZ, endpoint="quiz")
+    second = await main.ai_q(QUIZ, endpoint="quiz")
+    assert first == second
+    assert len(upstream) == 2   # every click asks for a fresh question
+
+
+N = 8
+EVALUATE = main.evaluation_prompt("Expand (x + 1)^2", "x^2 + 2x + 1", "x² + 2x + 1")
+
+
+async def test_concurrent_identical_quiz_prompts_share_one_call(upstream):
+    results = await asyncio.gather(*(main.ai_q(QUIZ, endpoint="quiz") for _ in range(N)))
+    assert len(upstream) == 1
+    assert len(set(results)) == 1
+    assert main.ai_cache.counters["quiz"]["coalesced"] >= N - 1
+
+
+async def test_concurrent_evaluations_are_not_coalesced(upstream):
+    await asyncio.gather(*(main.ai_q(EVALUATE, endpoint="evaluate") for _ in range(N)))
+    assert len(upstream) == N   # each student's evaluation is their own
+
+
+async def test_cancelled_caller_does_not_cancel_the_shared_call(upstream):
+    prompt = QUIZ + " (cancel)"
+    leader = asyncio.create_task(main.ai_q(prompt, endpoint="quiz"))
+    follower = asyncio.create_task(main.ai_q(prompt, endpoint="quiz"))
+    await asyncio.sleep(0.01)
+    leader.cancel()
+    assert "question" in await follower
+    assert len(upstream) == 1
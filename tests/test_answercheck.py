@@ -0,0 +1,49 @@
+import pytest
+
+import answercheck
+from answercheck import check
+
+
+@pytest.mark.parametrize("student, reference", [
+    ("x = 3", "x > 3."),
+    ("x = 3", "x ≥ 3"),
+    ("x = 3", "The solution set is x < 3"),
+    ("x = 3", "x ≠ 3"),
+    ("x > 3", "x = 3"),
+    ("(2x+1)(x-3)", "Expand: 2x² - 5x - 3."),
+    ("6/8", "Simplify to lowest terms: 3/4"),
+    ("(x - 2)(x - 3)", "Factor: x² - 5x + 6"),
+    ("x = 4", "2x + 3 = 11, so x = 4. Check: 2(4) + 3 = 11"),
+])
+def test_form_and_inequality_tasks_go_to_the_model(student, reference):
+    assert check(student, reference) is None
+
+
+@pytest.mark.parametrize("student, reference", [
+    ("(2x + 1)(x - 3)", "Combine like terms to get the final area: 2x² - 5x - 3."),
+    ("2x^2 - 5x - 3", "2x² - 5x - 3"),
+    ("x = 4", "x = 4"),
+    ("0.75", "The answer is 3/4."),
+])
+def test_equal_final_answers_are_right(student, reference):
+    assert check(student, reference) is True
+
+
+def test_wrong_only_when_both_sides_are_bare():
+    assert check("x = 4", "x = 3") is False
+    assert check("x = 4", "The solution is x = 3.") is None
+    assert check("Expanding gives 2x^2 - 6x - 3", "2x² - 5x - 3") is None
+
+
+@pytest.mark.parametrize("student, reference", [
+    ("x = 2 or x = 3", "x = 2, x = 3"),
+    ("", "x = 3"),
+    ("x = 3", ""),
+    ("I don't know", "x = 3"),
+])
+def test_unclear_answers_go_to_the_model(student, reference):
+    assert check(student, reference) is None
+
+
+def test_feedback_is_marked_local():
+    assert answercheck.feedback(True, "x = 4", "x = 4")["checked_locally"] is True
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+import main
+from admission import Overloaded, PriorityGate
+
+pytestmark = pytest.mark.anyio
+
+
+async def drain(response):
+    return [chunk async for chunk in response.body_iterator]
+
+
+async def test_try_acquire_never_jumps_the_queue():
+    gate = PriorityGate(limit=1)
+    assert gate.try_acquire()
+    assert not gate.try_acquire()
+    waiter = asyncio.create_task(gate.acquire(0))
+    await asyncio.sleep(0)
+    gate.release()            # the slot goes to the waiter, not to a later try_acquire
+    await waiter
+    assert not gate.try_acquire()
+    gate.release()
+    assert gate.active == 0
+
+
+async def test_batch_jobs_use_only_idle_gate_slots(monkeypatch):
+    monkeypatch.setattr(main, "BATCH_CONCURRENCY", 4)
+    gate = PriorityGate(limit=2)
+    await gate.acquire(0)     # the slot the batch request was admitted with
+    running, peak = 0, 0
+
+    async def job():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        return [{"ok": True}]
+
+    lines = await drain(main.stream_jobs([job] * 6, gate=gate))
+    assert len(lines) == 7
+    assert peak == 2          # its own slot plus the one idle slot, not BATCH_CONCURRENCY
+    assert gate.active == 1
+
+
+async def test_batch_quiz_is_charged_before_the_pool_is_touched(monkeypatch):
+    charged, taken = [], []
+
+    async def user(request):
+        return {"id": 1}
+
+    async def charge(user_id, cost=1):
+        charged.append(cost)
+        raise Overloaded("user_rate", 3)
+
+    async def take(topic, difficulty, user_id):
+        taken.append(topic)
+        return {"question": "q", "solution": "s", "difficulty": difficulty}
+
+    monkeypatch.setattr(main, "get_current_user", user)
+    monkeypatch.setattr(main, "QUIZ_POOL_ENABLED", True)
+    monkeypatch.setattr(main, "QUIZ_POOL_BATCH", 5)
+    monkeypatch.setattr(main.admission, "charge", charge)
+    monkeypatch.setattr(main.quiz_pool, "take", take)
+    batch = main.QuizBatchRequest(items=[{"topic": "algebra", "difficulty": "easy", "count": 7},
+                                         {"topic": "geometry", "difficulty": "easy", "count": 2}])
+    response = await main.batch_generate_quiz(None, batch)
+    assert response.status_code == 429
+    assert charged == [2]     # three prompts in the worst case, one already paid at admission
+    assert taken == []        # nothing served from the pool and then thrown away
+
+
+def test_batch_evaluations_rank_with_single_evaluations():
+    assert main.AI_ROUTES["/api/batch/evaluate_answer"][1] == main.AI_ROUTES["/api/evaluate_answer"][1]
+    assert main.AI_ROUTES["/api/batch/evaluate_answer"][1] < main.AI_ROUTES["/api/get_lesson"][1]
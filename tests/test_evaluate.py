@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+FAILED = json.dumps({"error": "AI provider error: all providers failed"})
+ANSWER = dict(question="Solve x + 1 > 3", user_solution="x > 2", correct_solution="x > 2",
+              topic="algebra", difficulty="easy")   # inequalities always go to the model
+
+
+@pytest.fixture
+def provider_down(monkeypatch):
+    recorded, timed = [], []
+
+    async def user(request):
+        return {"id": 1}
+
+    async def ai_q(prompt, endpoint=None):
+        return FAILED
+
+    async def ai_stream(prompt, endpoint=None):
+        yield FAILED
+
+    async def record_attempt(*row):
+        recorded.append(row)
+
+    monkeypatch.setattr(main, "get_current_user", user)
+    monkeypatch.setattr(main, "ai_q", ai_q)
+    monkeypatch.setattr(main, "ai_stream", ai_stream)
+    monkeypatch.setattr(main, "record_attempt", record_attempt)
+    monkeypatch.setattr(main.answer_stats, "record_model", timed.append)
+    return recorded, timed
+
+
+async def test_provider_failure_is_not_recorded_as_an_attempt(provider_down):
+    response = await main.evaluate_answer(None, stream=False, **ANSWER)
+    assert response.status_code == 500
+    assert provider_down == ([], [])
+
+
+async def test_stream_and_batch_agree(provider_down):
+    response = await main.evaluate_answer(None, stream=True, **ANSWER)
+    lines = [json.loads(chunk) async for chunk in response.body_iterator]
+    assert lines[-1] == {"error": "AI provider error: all providers failed"}
+
+    batch = main.AnswerBatchRequest(answers=[ANSWER])
+    response = await main.batch_evaluate_answer(None, batch)
+    lines = [json.loads(chunk) async for chunk in response.body_iterator]
+    assert "error" in lines[0] and lines[-1]["recorded"] == 0
+    assert provider_down == ([], [])
@@ -0,0 +1,38 @@
+import history
+from migrations import _user_topic_stats, _user_daily_stats
+
+LEGACY = [None, 0, 1, "false", "0", "true", " True "]
+
+
+def test_page_reads_legacy_is_correct_like_the_charts(pool):
+    with pool.connection() as conn:
+        with conn:
+            conn.executescript("""
+            CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL);
+            CREATE TABLE quiz_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                topic TEXT NOT NULL,
+                difficulty TEXT NOT NULL,
+                question TEXT NOT NULL,
+                user_solution TEXT,
+                is_correct BOOLEAN,
+                ts DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            );
+            INSERT INTO users (id, username) VALUES (1, 'alice');
+            """)
+            conn.executemany("""
+                INSERT INTO quiz_history (user_id, topic, difficulty, question, user_solution, is_correct)
+                VALUES (1, 'algebra', 'easy', ?, 'a', ?)
+            """, [(f"q{i}", value) for i, value in enumerate(LEGACY)])
+            _user_topic_stats(conn)
+            _user_daily_stats(conn)
+
+        items = history.page(conn, 1)["items"]
+        by_question = {item["question"]: item["is_correct"] for item in items}
+        assert by_question == {"q0": False, "q1": False, "q2": True, "q3": False,
+                               "q4": False, "q5": True, "q6": True}
+        correct = sum(item["is_correct"] for item in items)
+        assert history.topics(conn, 1)[0]["correct"] == correct
+        assert history.accuracy(conn, 1)[0]["correct"] == correct
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+import main
+import ocr
+from ocr import OCRJobs
+from workpool import BoundedPool
+
+pytestmark = pytest.mark.anyio
+
+HEADER = b"\x89PNG\r\n\x1a\n"
+PNG = HEADER + b"pixels" * 10
+
+
+@pytest.fixture
+async def api(monkeypatch, tmp_path):
+    """The app with a thread-backed OCR pool, a stubbed extract() and user 1 logged in."""
+    main.db_init()
+    calls, release = [], threading.Event()
+    release.set()
+
+    def extract(path):
+        calls.append(path)
+        release.wait(5)
+        with open(path, "rb") as f:
+            return f.read()[len(HEADER):].decode().strip()   # the "text" in the picture
+
+    async def user(request):
+        return {"id": 1}
+
+    workers = BoundedPool("ocr", workers=1, max_queue=1)
+    jobs = OCRJobs(workers, upload_dir=str(tmp_path), max_bytes=1024)
+    monkeypatch.setattr(ocr, "extract", extract)
+    monkeypatch.setattr(main, "ocr_pool", workers)
+    monkeypatch.setattr(main, "ocr_jobs", jobs)
+    monkeypatch.setattr(main, "get_current_user", user)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+        client.calls, client.release, client.jobs = calls, release, jobs
+        yield client
+    release.set()
+    await jobs.stop()
+    workers.close()
+
+
+def upload(client, data=PNG, content_type="image/png"):
+    return client.post("/api/ocr", files={"image": ("problem.png", data, content_type)})
+
+
+async def test_rejects_non_images(api):
+    response = await upload(api, b"hello", "text/plain")
+    assert response.status_code == 415
+    assert api.calls == []
+
+
+async def test_rejects_oversized_uploads(api, tmp_path):
+    response = await upload(api, b"x" * 2048)
+    assert response.status_code == 413
+    assert list(tmp_path.iterdir()) == []   # the partial file is removed
+
+
+async def test_sheds_load_when_the_pool_is_full(api, monkeypatch):
+    monkeypatch.setattr(main.ocr_pool, "pending", main.ocr_pool.workers + main.ocr_pool.max_queue)
+    response = await upload(api)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+
+
+async def test_job_states_and_the_content_hash_cache(api):
+    api.release.clear()
+    response = await upload(api, PNG + b"x + 1 = 3")
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    response = await api.post("/api/solve_problem", data={"ocr_job": job_id})
+    assert response.status_code == 409         # still queued or running
+    assert (await api.get(f"/api/ocr/{job_id + 1000}")).status_code == 404
+    response = await api.post("/api/solve_problem", data={"ocr_job": job_id + 1000})
+    assert response.status_code == 404
+
+    api.release.set()
+    await api.jobs.stop()
+    job = (await api.get(f"/api/ocr/{job_id}")).json()
+    assert job["status"] == "done" and job["text"] == "pixels" * 10 + "x + 1 = 3"
+
+    response = await upload(api, PNG + b"x + 1 = 3")   # same bytes again
+    assert response.status_code == 200
+    assert response.json()["cached"] is True and response.json()["text"] == job["text"]
+    assert len(api.calls) == 1
+    assert api.jobs.cache_hits == 1
+
+
+async def test_solving_a_job_with_no_text(api):
+    response = await upload(api, HEADER)
+    job_id = response.json()["job_id"]
+    await api.jobs.stop()
+    assert (await api.get(f"/api/ocr/{job_id}")).json()["text"] == ""
+    response = await api.post("/api/solve_problem", data={"ocr_job": job_id})
+    assert response.status_code == 400
@@ -0,0 +1,156 @@
+import json
+import asyncio
+
+import httpx
+import pytest
+
+import mockserver
+from providers import (Provider, ProviderRouter, ProviderError, RetryableError, OpenAIProvider,
+                       mock_response)
+
+pytestmark = pytest.mark.anyio
+
+QUIZ = "Generate a single math quiz question on the topic of 'Algebra' with a difficulty of 'easy'."
+
+
+class Scripted(Provider):
+    """Plays back `script` one entry per attempt: an exception to raise or text to return."""
+
+    def __init__(self, name, script, latency=0.0, **kwargs):
+        kwargs = {"backoff": 0.001, **kwargs}
+        super().__init__(name, **kwargs)
+        self.name = name
+        self.script = list(script)
+        self.latency = latency
+        self.attempts = 0
+
+    async def _complete(self, prompt):
+        self.attempts += 1
+        await asyncio.sleep(self.latency)
+        outcome = self.script.pop(0) if len(self.script) > 1 else self.script[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+async def test_retryable_errors_are_retried():
+    p = Scripted("a", [RetryableError("HTTP 503"), RetryableError("HTTP 429"), "ok"], retries=2)
+    assert await p.complete("x") == "ok"
+    assert (p.attempts, p.retried, p.errors, p.consecutive_failures) == (3, 2, 0, 0)
+
+
+async def test_retries_run_out():
+    p = Scripted("a", [RetryableError("HTTP 503")], retries=2)
+    with pytest.raises(ProviderError):
+        await p.complete("x")
+    assert (p.attempts, p.errors) == (3, 1)
+
+
+async def test_fatal_errors_are_not_retried():
+    p = Scripted("a", [ProviderError("HTTP 400: bad request"), "ok"], retries=2)
+    with pytest.raises(ProviderError, match="400"):
+        await p.complete("x")
+    assert (p.attempts, p.retried) == (1, 0)
+
+
+async def test_unexpected_exceptions_become_provider_errors():
+    p = Scripted("a", [KeyError("choices")], retries=2)
+    with pytest.raises(ProviderError, match="choices"):
+        await p.complete("x")
+    assert p.attempts == 1
+
+
+def test_check_sorts_statuses():
+    with pytest.raises(RetryableError) as e:
+        Provider._check(httpx.Response(429, headers={"retry-after": "3"}))
+    assert e.value.retry_after == 3.0
+    with pytest.raises(ProviderError) as e:
+        Provider._check(httpx.Response(401, text="invalid key"))
+    assert not isinstance(e.value, RetryableError)
+    Provider._check(httpx.Response(200))
+
+
+def test_backoff_is_jittered_and_honours_retry_after():
+    p = Provider("m", backoff=1.0)
+    delays = {p._delay(2) for _ in range(50)}
+    assert all(2.0 <= d <= 6.0 for d in delays) and len(delays) > 1
+    assert p._delay(0, retry_after=7.0) == 7.0
+    assert p._delay(0, retry_after=600.0) == 30.0
+
+
+async def test_repeated_failures_cool_a_provider_down():
+    p = Scripted("a", [ProviderError("HTTP 400")], retries=0, failure_threshold=3, cooldown=0.05)
+    for _ in range(3):
+        assert p.available
+        with pytest.raises(ProviderError):
+            await p.complete("x")
+    assert not p.available
+    await asyncio.sleep(0.06)
+    assert p.available
+
+
+async def test_router_fails_over_to_the_next_provider():
+    bad = Scripted("bad", [RetryableError("HTTP 503")], retries=1)
+    good = Scripted("good", ["ok"])
+    router = ProviderRouter([bad, good])
+    assert await router.complete("x") == "ok"
+    assert router.failovers == 1 and bad.attempts == 2 and good.attempts == 1
+
+
+async def test_router_reports_every_failure():
+    router = ProviderRouter([Scripted("a", [ProviderError("a down")]), Scripted("b", [ProviderError("b down")])])
+    with pytest.raises(ProviderError, match="a down; b down"):
+        await router.complete("x")
+
+
+async def test_router_ranks_by_observed_latency_and_skips_cooled_down():
+    slow, fast = Scripted("slow", ["slow"], latency=0.03), Scripted("fast", ["fast"], latency=0.0)
+    router = ProviderRouter([slow, fast])
+    assert await router.complete("x") == "slow"     # untried providers go in configured order
+    assert await router.complete("x") == "fast"     # fast is still unmeasured, so it is tried next
+    assert router.ranked() == [fast, slow]
+    assert await router.complete("x") == "fast"
+
+    fast.cooldown_until = float("inf")
+    assert router.ranked() == [slow, fast]
+    assert await router.complete("x") == "slow"
+
+
+async def test_stream_fails_over_only_before_the_first_delta():
+    class Broken(Scripted):
+        async def _stream(self, prompt):
+            yield "par"
+            raise RetryableError("connection reset")
+
+    router = ProviderRouter([Scripted("bad", [RetryableError("HTTP 503")], retries=0), Scripted("good", ["ok"])])
+    assert [d async for d in router.stream("x")] == ["ok"]
+
+    router = ProviderRouter([Broken("broken", ["unused"], retries=2), Scripted("good", ["ok"])])
+    seen = []
+    with pytest.raises(ProviderError):
+        async for delta in router.stream("x"):
+            seen.append(delta)
+    assert seen == ["par"]   # a half-sent answer isn't retried or restarted elsewhere
+
+
+@pytest.fixture
+def mock_openai(monkeypatch):
+    monkeypatch.setattr(mockserver, "LATENCY", 0.0)
+    provider = OpenAIProvider("test", base_url="http://mock/v1", backoff=0.001)
+    provider._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=mockserver.app))
+    yield provider
+
+
+async def test_openai_provider_against_the_mock_server(mock_openai):
+    assert json.loads(await mock_openai.complete(QUIZ)) == json.loads(mock_response(QUIZ))
+    streamed = "".join([d async for d in mock_openai.stream(QUIZ)])
+    assert json.loads(streamed) == json.loads(mock_response(QUIZ))
+    await mock_openai.aclose()
+
+
+async def test_openai_provider_retries_injected_503s(mock_openai, monkeypatch):
+    monkeypatch.setattr(mockserver, "FAIL_RATE", 1.0)
+    with pytest.raises(ProviderError, match="503"):
+        await mock_openai.complete(QUIZ)
+    assert mock_openai.retried == mock_openai.retries
+    await mock_openai.aclose()
@@ -0,0 +1,66 @@
+import pytest
+
+from quizpool import QuizPool
+
+pytestmark = pytest.mark.anyio
+
+
+def make(pool, generate, **kwargs):
+    qp = QuizPool(generate, pool=pool, low_water=2, target=4, batch=2, interval=30.0, **kwargs)
+    with pool.connection() as conn, conn:
+        qp.init(conn)
+        conn.execute("CREATE TABLE quiz_history (user_id INTEGER, topic TEXT, difficulty TEXT, question TEXT)")
+    return qp
+
+
+async def test_wanted_pools_are_capped(pool):
+    async def generate(topic, difficulty, n):
+        return []
+    qp = make(pool, generate, max_wanted=3)
+    for i in range(10):
+        await qp.take(f"topic {i}", "easy", 1)
+    assert sorted(qp._wanted) == [("topic 7", "easy"), ("topic 8", "easy"), ("topic 9", "easy")]
+
+
+async def test_pools_not_requested_recently_expire(pool):
+    calls = []
+    async def generate(topic, difficulty, n):
+        calls.append(topic)
+        return [{"question": f"{topic} {len(calls)} {i}", "solution": "s"} for i in range(n)]
+    qp = make(pool, generate, wanted_ttl=60)
+    qp.want("old", "easy")
+    qp._wanted[("old", "easy")] -= 120
+    qp.want("new", "easy")
+    qp._expire()
+    await qp.refill_once()
+    assert set(calls) == {"new"}
+
+
+async def test_empty_batches_back_off(pool):
+    calls = []
+    async def generate(topic, difficulty, n):
+        calls.append(topic)
+        return [{"question": "always the same", "solution": "s"}]
+    qp = make(pool, generate)
+    qp.want("algebra", "easy")
+    await qp.refill_once()    # adds one question, then the repeat adds nothing
+    assert len(calls) == 2
+    await qp.refill_once()
+    assert len(calls) == 2    # backing off: no provider call
+    until, failures = qp._backoff[("algebra", "easy")]
+    assert failures == 1
+    qp._backoff[("algebra", "easy")] = (0, failures)
+    await qp.refill_once()
+    assert len(calls) == 3
+    assert qp._backoff[("algebra", "easy")][1] == 2   # doubled
+
+
+async def test_provider_errors_back_off(pool):
+    async def generate(topic, difficulty, n):
+        raise RuntimeError("quota")
+    qp = make(pool, generate)
+    qp.want("algebra", "easy")
+    await qp.refill_once()
+    await qp.refill_once()
+    assert qp.refill_errors == 1
+    assert (await qp.stats())["backing_off"] == 1
@@ -0,0 +1,119 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+import sharedstate
+from sharedstate import MemoryState, SQLiteState, RedisState, Coordinator
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+async def state(request, pool):
+    if request.param == "memory":
+        yield MemoryState()
+    elif request.param == "sqlite":
+        s = SQLiteState(pool)
+        with pool.connection() as conn, conn:
+            s.init(conn)
+        yield s
+    else:
+        s = RedisState(client=fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True))
+        yield s
+        await s.aclose()
+
+
+async def test_throttle_spends_the_burst_then_refuses(state):
+    for _ in range(3):
+        assert await state.throttle("bucket", rate=1.0, burst=3) == (True, 0.0)
+    ok, retry = await state.throttle("bucket", rate=1.0, burst=3)
+    assert not ok and 0 < retry <= 1.0
+    ok, retry = await state.throttle("bucket", rate=1.0, burst=3, cost=3)
+    assert not ok and 2.0 < retry <= 3.0
+    assert (await state.throttle("other", rate=1.0, burst=3))[0]   # buckets are independent
+
+
+async def test_throttle_refills_at_rate(state):
+    assert (await state.throttle("bucket", rate=20.0, burst=1))[0]
+    assert not (await state.throttle("bucket", rate=20.0, burst=1))[0]
+    await asyncio.sleep(0.06)
+    assert (await state.throttle("bucket", rate=20.0, burst=1))[0]
+
+
+async def test_one_owner_holds_a_lease(state):
+    assert await state.acquire("lease:job", "a", ttl=5)
+    assert not await state.acquire("lease:job", "b", ttl=5)
+    assert await state.acquire("lease:job", "a", ttl=5)   # renewal
+    await state.release("lease:job", "b")                 # not b's to release
+    assert not await state.acquire("lease:job", "b", ttl=5)
+    await state.release("lease:job", "a")
+    assert await state.acquire("lease:job", "b", ttl=5)
+
+
+async def test_unrenewed_lease_lapses(state):
+    assert await state.acquire("lease:job", "a", ttl=0.05)
+    await asyncio.sleep(0.1)
+    assert await state.acquire("lease:job", "b", ttl=5)
+
+
+async def test_incr_counts_and_ttl_starts_with_the_counter(state):
+    assert await state.incr("hits", ttl=0.1) == 1
+    assert await state.incr("hits", 4, ttl=0.1) == 5
+    assert await state.get("hits") == "5"
+    await asyncio.sleep(0.15)
+    assert await state.get("hits") is None
+    assert await state.incr("hits") == 1
+
+
+async def test_publish_then_read_from_the_tail(state):
+    await state.publish("users", "old")
+    cursor = await state.tail("users")
+    cursor, messages = await state.read("users", cursor)
+    assert messages == []
+    await state.publish("users", "alice")
+    await state.publish("users", "bob")
+    await state.publish("other", "carol")
+    cursor, messages = await state.read("users", cursor)
+    assert messages == ["alice", "bob"]
+    assert await state.read("users", cursor) == (cursor, [])
+
+
+async def test_coordinator_delivers_broadcasts_to_other_workers(state):
+    seen_a, seen_b = [], []
+    a, b = Coordinator(state, worker_id="a"), Coordinator(state, worker_id="b")
+    a.on("users", seen_a.append)
+    b.on("users", seen_b.append)
+    a.lease("quiz_pool")
+    b.lease("quiz_pool")
+    await a.start()
+    await b.start()
+    assert a.holds("quiz_pool") and not b.holds("quiz_pool")
+    await a.broadcast("users", "alice")
+    await a.sync()
+    await b.sync()
+    assert seen_a == ["alice"] and seen_b == ["alice"]   # the sender isn't told twice
+    await a.stop()                                       # hands the lease over
+    await b.sync()
+    assert b.holds("quiz_pool")
+    await b.stop()
+
+
+def test_from_url_rejects_unknown_backends():
+    assert isinstance(sharedstate.from_url("memory"), MemoryState)
+    with pytest.raises(ValueError):
+        sharedstate.from_url("memcached://localhost")
+
+
+class DownState(MemoryState):
+    async def publish(self, channel, message):
+        raise ConnectionError("shared state unavailable")
+
+
+async def test_broadcast_survives_a_failed_publish():
+    seen = []
+    coordinator = Coordinator(DownState(), worker_id="a")
+    coordinator.on("users", seen.append)
+    await coordinator.broadcast("users", "alice")   # doesn't raise into the request
+    assert seen == ["alice"]
+    assert coordinator.stats()["errors"] == 1 and coordinator.stats()["sent"] == 0
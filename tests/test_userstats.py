@@ -0,0 +1,67 @@
+import main
+import userstats
+from migrations import _user_topic_stats, _user_daily_stats
+
+LEGACY = [
+    # rows written before the stats tables existed, is_correct exactly as the model returned it
+    (1, "algebra", "easy", None),
+    (1, "algebra", "easy", 1),
+    (1, "algebra", "easy", "true"),
+    (1, "algebra", "hard", "false"),
+    (1, "geometry", "medium", 0),
+    (2, "algebra", "easy", True),
+    (2, "calculus", "hard", None),
+]
+NEW = [
+    (1, "algebra", "easy", "q", "a", True),
+    (1, "algebra", "easy", "q", "a", False),
+    (1, "calculus", "hard", "q", "a", True),
+    (2, "calculus", "hard", "q", "a", False),
+    (3, "geometry", "easy", "q", "a", True),
+]
+
+
+def setup(conn):
+    main_ddl = """
+    CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL);
+    CREATE TABLE quiz_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        topic TEXT NOT NULL,
+        difficulty TEXT NOT NULL,
+        question TEXT NOT NULL,
+        user_solution TEXT,
+        is_correct BOOLEAN,
+        ts DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    );
+    """
+    conn.executescript(main_ddl)
+    conn.executemany("INSERT INTO users (id, username) VALUES (?, ?)", [(i, f"user{i}") for i in (1, 2, 3)])
+    conn.executemany("""
+        INSERT INTO quiz_history (user_id, topic, difficulty, question, user_solution, is_correct)
+        VALUES (?, ?, ?, 'q', 'a', ?)
+    """, LEGACY)
+
+
+def test_materialized_stats_match_the_live_aggregate(pool):
+    with pool.connection() as conn:
+        with conn:
+            setup(conn)
+            _user_topic_stats(conn)    # the migrations build the tables from existing history
+            _user_daily_stats(conn)
+        with conn:
+            main._write_history(conn, NEW[:2])
+        with conn:
+            main._write_history(conn, NEW[2:])
+        for user_id in (1, 2, 3, 4):
+            assert userstats.for_user(conn, user_id) == conn.execute(userstats.AGGREGATE, (user_id,)).fetchall()
+            assert (userstats.daily_for_user(conn, user_id)
+                    == conn.execute(userstats.DAILY_AGGREGATE, (user_id,)).fetchall())
+        assert userstats.verify(conn) == []
+        easy = [(r["is_correct"], r["count"]) for r in userstats.for_user(conn, 1)
+                if (r["topic"], r["difficulty"]) == ("algebra", "easy")]
+        assert easy == [(0, 2), (1, 3)]   # NULL reads as wrong, "true" as right
+        hard = [(r["is_correct"], r["count"]) for r in userstats.for_user(conn, 1) if r["difficulty"] == "hard"]
+        assert hard == [(0, 1), (1, 1)]   # the legacy "false" is not counted correct
+        assert userstats.version(conn, 1) == 8
@@ -0,0 +1,42 @@
+import time
+
+import pytest
+
+from writebehind import WriteBehind
+
+pytestmark = pytest.mark.anyio
+
+
+def slow_flush(written):
+    def flush(conn, rows):
+        time.sleep(0.2)
+        written.extend(rows)
+    return flush
+
+
+async def test_drain_waits_only_for_the_callers_rows(pool):
+    written = []
+    writer = WriteBehind(pool, slow_flush(written), max_delay=0.01, key=lambda row: row[0])
+    await writer.put((2, "b"))
+    assert writer.pending(2) == 1 and writer.pending(1) == 0
+
+    start = time.perf_counter()
+    await writer.drain(1)   # nothing queued for user 1
+    assert time.perf_counter() - start < 0.05
+    assert written == []
+
+    await writer.drain(2)
+    assert written == [(2, "b")]
+    assert writer.pending(2) == 0
+    await writer.stop()
+
+
+async def test_drain_without_key_waits_for_everything(pool):
+    written = []
+    writer = WriteBehind(pool, slow_flush(written), max_delay=0.01, key=lambda row: row[0])
+    await writer.put((1, "a"))
+    await writer.put((2, "b"))
+    await writer.drain()
+    assert sorted(written) == [(1, "a"), (2, "b")]
+    assert writer.stats()["pending_keys"] == 0
+    await writer.stop()
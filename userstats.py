@@ -0,0 +1,138 @@
+# userstats.py  (materialized per-user dashboard stats)
+#
+# user_topic_stats holds the same numbers the dashboard used to compute with
+# GROUP BY over quiz_history, kept up to date row by row as answers are
+# written, so a dashboard view is a primary-key range read. user_daily_stats
+# does the same per UTC day for the accuracy-over-time series.
+#
+#   python userstats.py rebuild [user_id]   recompute from quiz_history
+#   python userstats.py verify              compare against the live aggregate
+import sys
+from collections import Counter
+
+# Older rows hold is_correct as the model sent it: NULL, 0/1, or "true"/"false".
+# Read it the way main._as_bool does, so every count agrees on what was correct.
+CORRECT = "(CASE WHEN lower(trim(is_correct)) IN ('1', 'true', 'yes') THEN 1 ELSE 0 END)"
+
+AGGREGATE = f"""
+    SELECT topic, difficulty, {CORRECT} AS is_correct, COUNT(*) AS count FROM quiz_history
+    WHERE user_id = ? GROUP BY topic, difficulty, {CORRECT} ORDER BY topic, difficulty, is_correct
+"""
+DAILY_AGGREGATE = f"""
+    SELECT date(ts) AS day, topic, difficulty, COUNT(*) AS attempts, SUM({CORRECT}) AS correct
+    FROM quiz_history WHERE user_id = ? GROUP BY date(ts), topic, difficulty ORDER BY day, topic, difficulty
+"""
+
+
+def create(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_topic_stats (
+        user_id INTEGER NOT NULL,
+        topic TEXT NOT NULL,
+        difficulty TEXT NOT NULL,
+        is_correct BOOLEAN NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (user_id, topic, difficulty, is_correct)
+    ) WITHOUT ROWID
+    """)
+
+
+def create_daily(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_daily_stats (
+        user_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        difficulty TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        correct INTEGER NOT NULL,
+        PRIMARY KEY (user_id, day, topic, difficulty)
+    ) WITHOUT ROWID
+    """)
+
+
+def record(conn, rows):
+    """Add quiz_history rows (user_id, topic, difficulty, question, user_solution, is_correct) to the counts."""
+    counts = Counter((r[0], r[1], r[2], r[5]) for r in rows)
+    conn.executemany("""
+        INSERT INTO user_topic_stats (user_id, topic, difficulty, is_correct, count) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, topic, difficulty, is_correct) DO UPDATE SET count = count + excluded.count
+    """, [key + (n,) for key, n in counts.items()])
+    attempts, correct = Counter(), Counter()
+    for r in rows:
+        attempts[(r[0], r[1], r[2])] += 1
+        correct[(r[0], r[1], r[2])] += int(bool(r[5]))
+    conn.executemany("""
+        INSERT INTO user_daily_stats (user_id, day, topic, difficulty, attempts, correct) VALUES (?, date('now'), ?, ?, ?, ?)
+        ON CONFLICT (user_id, day, topic, difficulty) DO UPDATE
+        SET attempts = attempts + excluded.attempts, correct = correct + excluded.correct
+    """, [key + (n, correct[key]) for key, n in attempts.items()])
+
+
+def rebuild(conn, user_id=None):
+    where, params = ("WHERE user_id = ?", (user_id,)) if user_id is not None else ("", ())
+    conn.execute(f"DELETE FROM user_topic_stats {where}", params)
+    conn.execute(f"""
+        INSERT INTO user_topic_stats (user_id, topic, difficulty, is_correct, count)
+        SELECT user_id, topic, difficulty, {CORRECT}, COUNT(*) FROM quiz_history {where}
+        GROUP BY user_id, topic, difficulty, {CORRECT}
+    """, params)
+
+
+def rebuild_daily(conn, user_id=None):
+    where, params = ("WHERE user_id = ?", (user_id,)) if user_id is not None else ("", ())
+    conn.execute(f"DELETE FROM user_daily_stats {where}", params)
+    conn.execute(f"""
+        INSERT INTO user_daily_stats (user_id, day, topic, difficulty, attempts, correct)
+        SELECT user_id, date(ts), topic, difficulty, COUNT(*), SUM({CORRECT}) FROM quiz_history {where}
+        GROUP BY user_id, date(ts), topic, difficulty
+    """, params)
+
+
+def for_user(conn, user_id):
+    return conn.execute("""
+        SELECT topic, difficulty, is_correct, count FROM user_topic_stats
+        WHERE user_id = ? ORDER BY topic, difficulty, is_correct
+    """, (user_id,)).fetchall()
+
+
+def daily_for_user(conn, user_id):
+    return conn.execute("""
+        SELECT day, topic, difficulty, attempts, correct FROM user_daily_stats
+        WHERE user_id = ? ORDER BY day, topic, difficulty
+    """, (user_id,)).fetchall()
+
+
+def version(conn, user_id):
+    """Number of answers recorded for the user; history is append-only, so this identifies its state."""
+    return conn.execute("SELECT COALESCE(SUM(count), 0) AS n FROM user_topic_stats WHERE user_id = ?",
+                        (user_id,)).fetchone()["n"]
+
+
+def verify(conn):
+    """Returns the ids of users whose materialized stats differ from the live aggregates."""
+    users = [r["user_id"] for r in conn.execute(
+        "SELECT user_id FROM quiz_history UNION SELECT user_id FROM user_topic_stats").fetchall()]
+    return [u for u in users
+            if for_user(conn, u) != conn.execute(AGGREGATE, (u,)).fetchall()
+            or daily_for_user(conn, u) != conn.execute(DAILY_AGGREGATE, (u,)).fetchall()]
+
+
+if __name__ == "__main__":
+    import db
+    command = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    with db.pool.connection() as conn:
+        create(conn)
+        create_daily(conn)
+        if command == "rebuild":
+            with conn:
+                user_id = int(sys.argv[2]) if len(sys.argv) > 2 else None
+                rebuild(conn, user_id)
+                rebuild_daily(conn, user_id)
+            print("user_topic_stats and user_daily_stats rebuilt")
+        elif command == "verify":
+            bad = verify(conn)
+            print(f"{len(bad)} user(s) out of sync" + (f": {bad}" if bad else ""))
+            sys.exit(1 if bad else 0)
+        else:
+            sys.exit(f"unknown command {command!r}; use rebuild [user_id] or verify")
@@ -0,0 +1,59 @@
+# workpool.py  (bounded off-loop workers for CPU-heavy calls)
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolSaturated(Exception):
+    """Raised instead of queueing when a BoundedPool already has max_queue jobs waiting."""
+
+
+class BoundedPool:
+    """A fixed-size executor with a cap on waiting jobs.
+
+    Jobs beyond `workers` running + `max_queue` waiting are rejected right
+    away with PoolSaturated, so callers can answer 503 instead of letting a
+    backlog build up behind slow work.
+    """
+
+    def __init__(self, name, workers=2, max_queue=16, executor_cls=ThreadPoolExecutor):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor_cls = executor_cls
+        self._executor = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self._executor_cls is ThreadPoolExecutor:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+            else:
+                self._executor = self._executor_cls(max_workers=self.workers)
+        return self._executor
+
+    async def run(self, fn, *args):
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise PoolSaturated(self.name)
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
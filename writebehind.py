@@ -0,0 +1,163 @@
+# writebehind.py  (batched background writes)
+import time
+import sqlite3
+import asyncio
+
+from telemetry import log
+
+_STOP = object()
+
+
+class WriteBehind:
+    """Queue rows and write them in batches: one transaction per `max_rows` rows
+    or every `max_delay` seconds, whichever comes first.
+
+    `flush(conn, rows)` does the actual writes and runs inside db.Pool.run, so
+    a whole batch costs one commit. stop() drains the queue, which is what makes
+    shutdown durable.
+
+    With `key(row)` given, queued rows are also counted per key, so drain(key)
+    waits only for that key's rows rather than for everyone's.
+    """
+
+    def __init__(self, pool, flush, max_rows=50, max_delay=0.05, max_queue=10000, retries=20, name="writer",
+                 key=None):
+        self.pool = pool
+        self.flush = flush
+        self.key = key
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.retries = retries
+        self.name = name
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._task = None
+        self._stopping = False
+        self._flushed = asyncio.Condition()
+        self._pending = {}   # key -> rows queued and not yet written
+        self.enqueued = 0
+        self.done = 0
+        self.rows_written = 0
+        self.batches = 0
+        self.errors = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.last_batch = 0
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    async def put(self, row):
+        """Queue one row; waits only if max_queue rows are already pending."""
+        if self._task is None:
+            self.start()
+        await self._queue.put(row)
+        self.enqueued += 1
+        if self.key is not None:
+            k = self.key(row)
+            self._pending[k] = self._pending.get(k, 0) + 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _collect(self):
+        rows = []
+        item = await self._queue.get()
+        deadline = time.monotonic() + self.max_delay
+        while item is not _STOP:
+            rows.append(item)
+            remaining = deadline - time.monotonic()
+            if len(rows) >= self.max_rows or remaining <= 0:
+                return rows
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return rows
+        self._stopping = True
+        return rows
+
+    async def _write(self, rows):
+        for attempt in range(self.retries + 1):
+            try:
+                await self.pool.run(self.flush, rows)
+                break
+            except sqlite3.OperationalError as e:
+                # Most likely a locked database: keep the rows and try again
+                self.errors += 1
+                if attempt == self.retries:
+                    self.dropped += len(rows)
+                    log.error("dropping batch", extra={"fields": {"writer": self.name, "rows": len(rows),
+                                                                  "attempts": attempt + 1, "error": str(e)}})
+                    return
+                await asyncio.sleep(min(5.0, 0.1 * (attempt + 1)))
+            except Exception as e:
+                # A bad row would fail every retry; write the batch row by row instead
+                self.errors += 1
+                if len(rows) == 1:
+                    self.dropped += 1
+                    log.error("dropping row", extra={"fields": {"writer": self.name, "row": rows[0], "error": str(e)}})
+                    return
+                for row in rows:
+                    await self._write([row])
+                return
+        self.rows_written += len(rows)
+        self.batches += 1
+        self.last_batch = len(rows)
+
+    async def _run(self):
+        while not self._stopping:
+            rows = await self._collect()
+            if rows:
+                await self._write(rows)
+                async with self._flushed:
+                    self.done += len(rows)
+                    if self.key is not None:
+                        for row in rows:
+                            k = self.key(row)
+                            self._pending[k] -= 1
+                            if not self._pending[k]:
+                                del self._pending[k]
+                    self._flushed.notify_all()
+
+    def pending(self, key):
+        """Rows queued under `key` that haven't been written yet."""
+        return self._pending.get(key, 0)
+
+    async def drain(self, key=None):
+        """Wait until every row queued before this call has been written (read-your-writes).
+        With a key, wait only until that key has nothing queued; other keys' rows
+        are left to their batch."""
+        if key is not None:
+            if not self._pending.get(key):
+                return
+            async with self._flushed:
+                await self._flushed.wait_for(lambda: not self._pending.get(key))
+            return
+        target = self.enqueued
+        if self.done >= target:
+            return
+        async with self._flushed:
+            await self._flushed.wait_for(lambda: self.done >= target)
+
+    async def stop(self):
+        """Write out everything queued so far, then end the background task."""
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        self._stopping = False
+
+    def stats(self):
+        return {
+            "queue_depth": self.depth,
+            "pending_keys": len(self._pending),
+            "max_depth": self.max_depth,
+            "rows_written": self.rows_written,
+            "batches": self.batches,
+            "last_batch": self.last_batch,
+            "errors": self.errors,
+            "dropped": self.dropped,
+        }